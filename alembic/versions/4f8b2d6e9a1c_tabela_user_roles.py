@@ -0,0 +1,81 @@
+"""tabela user_roles
+
+Revision ID: 4f8b2d6e9a1c
+Revises: 7c2e9a4b1d3f
+Create Date: 2026-10-18 10:41:27.530914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f8b2d6e9a1c'
+down_revision: Union[str, None] = '7c2e9a4b1d3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+users = sa.table('users', sa.column('id', sa.Integer), sa.column('funcoes', sa.String))
+user_roles = sa.table('user_roles', sa.column('user_id', sa.Integer), sa.column('role', sa.String))
+
+
+def _users_batches(conn):
+    # keyset on id so big tables are not loaded at once
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(users.c.id, users.c.funcoes)
+            .where(users.c.id > last_id)
+            .order_by(users.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_roles',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('role', sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'role'),
+    )
+    op.create_index('ix_user_roles_role_user_id', 'user_roles', ['role', 'user_id'], unique=False)
+
+    # backfill: "admin,usuario_regular" -> one row per role (blank and repeated entries dropped)
+    conn = op.get_bind()
+    for rows in _users_batches(conn):
+        values = []
+        for user_id, funcoes in rows:
+            for role in dict.fromkeys(funcao.strip() for funcao in (funcoes or '').split(',')):
+                if role:
+                    values.append({'user_id': user_id, 'role': role})
+        if values:
+            op.bulk_insert(user_roles, values)
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('funcoes')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('funcoes', sa.String(), nullable=True))
+
+    conn = op.get_bind()
+    funcoes = {}
+    for user_id, role in conn.execute(
+        sa.select(user_roles.c.user_id, user_roles.c.role).order_by(user_roles.c.user_id, user_roles.c.role)
+    ):
+        funcoes.setdefault(user_id, []).append(role)
+    for user_id, roles in funcoes.items():
+        conn.execute(users.update().where(users.c.id == user_id).values(funcoes=','.join(roles)))
+
+    op.drop_index('ix_user_roles_role_user_id', table_name='user_roles')
+    op.drop_table('user_roles')
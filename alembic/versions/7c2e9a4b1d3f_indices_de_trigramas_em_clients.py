@@ -0,0 +1,36 @@
+"""indices de trigramas em clients
+
+Revision ID: 7c2e9a4b1d3f
+Revises: ef10436a907f
+Create Date: 2026-10-18 09:12:40.118532
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e9a4b1d3f'
+down_revision: Union[str, None] = 'ef10436a907f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # pg_trgm only exists on Postgres; other databases use the in-process index (app/search.py)
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_clients_name_trgm', 'clients', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_clients_email_trgm', 'clients', ['email'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'email': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_clients_email_trgm', table_name='clients')
+    op.drop_index('ix_clients_name_trgm', table_name='clients')
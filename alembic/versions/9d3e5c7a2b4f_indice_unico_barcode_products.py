@@ -0,0 +1,41 @@
+"""indice unico barcode products
+
+Revision ID: 9d3e5c7a2b4f
+Revises: 4f8b2d6e9a1c
+Create Date: 2026-10-18 13:05:52.671340
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d3e5c7a2b4f'
+down_revision: Union[str, None] = '4f8b2d6e9a1c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+products = sa.table('products', sa.column('id', sa.Integer), sa.column('barcode', sa.String))
+
+
+def upgrade() -> None:
+    # duplicated barcodes cannot be merged automatically (order_items point at
+    # both rows): stop and list them so they are fixed by hand first
+    duplicates = op.get_bind().execute(
+        sa.select(products.c.barcode, sa.func.count())
+        .where(products.c.barcode.is_not(None))
+        .group_by(products.c.barcode)
+        .having(sa.func.count() > 1)
+        .limit(20)
+    ).all()
+    if duplicates:
+        listed = ', '.join(f'{barcode!r} ({count}x)' for barcode, count in duplicates)
+        raise RuntimeError(f'products.barcode has duplicates, resolve them before upgrading: {listed}')
+
+    op.create_index(op.f('ix_products_barcode'), 'products', ['barcode'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_products_barcode'), table_name='products')
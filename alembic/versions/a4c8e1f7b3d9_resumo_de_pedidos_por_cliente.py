@@ -0,0 +1,74 @@
+"""resumo de pedidos por cliente
+
+Revision ID: a4c8e1f7b3d9
+Revises: e2a7c9d4f6b1
+Create Date: 2026-10-18 19:07:44.612093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4c8e1f7b3d9'
+down_revision: Union[str, None] = 'e2a7c9d4f6b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+clients = sa.table('clients', sa.column('id', sa.Integer))
+orders = sa.table(
+    'orders',
+    sa.column('id', sa.Integer),
+    sa.column('client_id', sa.Integer),
+    sa.column('total_order_price', sa.Numeric(10, 2)),
+    sa.column('created_at', sa.DateTime),
+)
+order_items = sa.table('order_items', sa.column('order_id', sa.Integer), sa.column('created_at', sa.DateTime))
+client_summaries = sa.table(
+    'client_summaries',
+    sa.column('client_id', sa.Integer),
+    sa.column('order_count', sa.Integer),
+    sa.column('lifetime_value', sa.Numeric(12, 2)),
+    sa.column('last_order_at', sa.DateTime),
+)
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('created_at', sa.DateTime(), nullable=True))
+    # pedidos antigos: a data do primeiro item é a melhor aproximação que existe
+    op.execute(
+        orders.update().values(created_at=(
+            sa.select(sa.func.min(order_items.c.created_at))
+            .where(order_items.c.order_id == orders.c.id)
+            .scalar_subquery()
+        ))
+    )
+
+    op.create_table('client_summaries',
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.Column('order_count', sa.Integer(), nullable=False),
+    sa.Column('lifetime_value', sa.Numeric(precision=12, scale=2), nullable=False),
+    sa.Column('last_order_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['client_id'], ['clients.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('client_id')
+    )
+    # backfill: um único INSERT ... SELECT agrupado por cliente
+    op.execute(client_summaries.insert().from_select(
+        ['client_id', 'order_count', 'lifetime_value', 'last_order_at'],
+        sa.select(
+            orders.c.client_id,
+            sa.func.count(),
+            sa.func.coalesce(sa.func.sum(orders.c.total_order_price), 0),
+            sa.func.max(orders.c.created_at),
+        )
+        .select_from(orders.join(clients, clients.c.id == orders.c.client_id))
+        .group_by(orders.c.client_id),
+    ))
+
+
+def downgrade() -> None:
+    op.drop_table('client_summaries')
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.drop_column('created_at')
@@ -0,0 +1,43 @@
+"""preco unitario dos itens
+
+Revision ID: c3f5a9e2d8b6
+Revises: a4c8e1f7b3d9
+Create Date: 2026-10-18 21:42:10.318467
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f5a9e2d8b6'
+down_revision: Union[str, None] = 'a4c8e1f7b3d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+products = sa.table('products', sa.column('id', sa.Integer), sa.column('sale_value', sa.Float))
+order_items = sa.table(
+    'order_items',
+    sa.column('product_id', sa.Integer),
+    sa.column('unit_price', sa.Numeric(10, 2)),
+)
+
+
+def upgrade() -> None:
+    op.add_column('order_items', sa.Column('unit_price', sa.Numeric(precision=10, scale=2), nullable=True))
+    # o preço da época não foi guardado: os itens existentes ficam com o preço
+    # de venda atual (python -m app.reconcile mostra os pedidos que divergem)
+    op.execute(
+        order_items.update().values(unit_price=(
+            sa.select(products.c.sale_value)
+            .where(products.c.id == order_items.c.product_id)
+            .scalar_subquery()
+        ))
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('order_items') as batch_op:
+        batch_op.drop_column('unit_price')
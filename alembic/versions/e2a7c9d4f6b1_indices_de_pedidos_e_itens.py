@@ -0,0 +1,44 @@
+"""indices de pedidos, itens e ordenacao de produtos
+
+Revision ID: e2a7c9d4f6b1
+Revises: b6e1f3a8c5d7
+Create Date: 2026-10-18 17:20:36.905112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a7c9d4f6b1'
+down_revision: Union[str, None] = 'b6e1f3a8c5d7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (name, table, columns): the foreign keys every order read joins or filters
+# on, and the sort keys of the product list pages
+INDEXES = [
+    ('ix_orders_client_id_id', 'orders', ['client_id', 'id']),
+    ('ix_order_items_order_id', 'order_items', ['order_id']),
+    ('ix_order_items_product_id', 'order_items', ['product_id']),
+    ('ix_products_description_id', 'products', ['description', 'id']),
+    ('ix_products_sale_value_id', 'products', ['sale_value', 'id']),
+]
+
+
+def upgrade() -> None:
+    # on Postgres the indexes are built CONCURRENTLY (outside the migration
+    # transaction), so order writes are not blocked while they build
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=concurrently)
+
+
+def downgrade() -> None:
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=concurrently)
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response, status
+
+from . import serializers
+from .replicas import REPLICA_STICKY_SECONDS, pinned_to_primary, replica_set
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "1024"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "30"))
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison: W/"x" matches "x"
+    candidates = (candidate.strip() for candidate in if_none_match.split(","))
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+# Serialized product responses (list pages and single products) keyed by the
+# request parameters. Every product write bumps the version, which makes all
+# entries stale at once; the TTL bounds staleness for writes made by other
+# processes. The ETag is a hash of the body, so it is the same in every
+# process for the same content.
+class CatalogCache:
+    def __init__(self, max_size: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = 0
+        self.bumped_at = float("-inf")
+        self._entries = OrderedDict()  # key -> (version, expires_at, etag, body)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    def bump(self):
+        self.version += 1
+        self.bumped_at = time.monotonic()
+        self._entries.clear()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != self.version or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2], entry[3]
+
+    # version is read before the query: a write committed in the meantime
+    # makes the body stale, so it is not stored
+    def put(self, key, etag: str, body: bytes, version: int):
+        if not self.enabled or version != self.version:
+            return
+        self._entries[key] = (version, time.monotonic() + self.ttl, etag, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+catalog_cache = CatalogCache()
+
+
+def _response(request: Request, etag: str, body: bytes) -> Response:
+    # no-cache: clients may store the body but must revalidate it with the ETag
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        catalog_cache.not_modified += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# With read replicas the cache must not undo read-your-writes: a client pinned
+# to the primary (it wrote recently) skips the cache, which may hold bodies
+# other clients read from a replica, and for REPLICA_STICKY_SECONDS after a
+# write no body is stored, since a lagging replica can still return the old
+# rows and they would be cached under the new version.
+def _bypass_replica_reads() -> bool:
+    return bool(replica_set.replicas) and pinned_to_primary()
+
+
+def _storable() -> bool:
+    return not replica_set.replicas or time.monotonic() - catalog_cache.bumped_at >= REPLICA_STICKY_SECONDS
+
+
+# load() runs the query and returns what adapter serializes (ORM objects are
+# fine); on a cache hit neither the query nor the serialization happens
+async def cached_response(request: Request, key, adapter, load) -> Response:
+    if _bypass_replica_reads():
+        body = serializers.dump_json(adapter, await load())
+        return _response(request, make_etag(body), body)
+
+    cached = catalog_cache.get(key)
+    if cached is not None:
+        return _response(request, *cached)
+
+    version = catalog_cache.version
+    body = serializers.dump_json(adapter, await load())
+    etag = make_etag(body)
+    if _storable():
+        catalog_cache.put(key, etag, body, version)
+    return _response(request, etag, body)
@@ -0,0 +1,162 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, models, schemas
+from .search import client_index
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+CSV_TYPES = {"text/csv", "application/csv"}
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines"}
+
+
+# decodes the body as it arrives and yields (line number, line) without
+# ever holding more than one network chunk plus a partial line in memory
+async def iter_lines(stream: AsyncIterator[bytes]):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    line_no = 0
+    async for chunk in stream:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield line_no + 1, buffer.rstrip("\r")
+
+
+# (line number, row dict or None, error or None) for each record
+async def iter_ndjson(stream: AsyncIterator[bytes]):
+    async for line_no, line in iter_lines(stream):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, None, "Invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, "Expected a JSON object"
+            continue
+        yield line_no, row, None
+
+
+async def iter_csv(stream: AsyncIterator[bytes]):
+    header = None
+    record, first_line = "", None
+    async for line_no, line in iter_lines(stream):
+        # a quoted field may contain line breaks: keep reading until the quotes balance
+        record = f"{record}\n{line}" if first_line is not None else line
+        first_line = first_line or line_no
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record_line, record, first_line = first_line, "", None
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [value.strip().lower() for value in values]
+            continue
+        if len(values) != len(header):
+            yield record_line, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield record_line, dict(zip(header, values)), None
+    if first_line is not None:
+        yield first_line, None, "Unterminated quoted field"
+
+
+def _error(line_no: int, reason: str) -> schemas.ClientImportError:
+    return schemas.ClientImportError(line=line_no, reason=reason)
+
+
+def _validation_reason(error: ValidationError) -> str:
+    first = error.errors()[0]
+    field = ".".join(str(part) for part in first["loc"]) or "row"
+    return f"{field}: {first['msg']}"
+
+
+# validates one chunk, drops rows whose email/cpf repeat inside the chunk or
+# already exist (one lookup for the whole chunk) and inserts the rest with a
+# single multi-row INSERT; each chunk is its own transaction
+async def _import_chunk(db: AsyncSession, chunk: List[Tuple[int, Optional[dict], Optional[str]]]):
+    errors = []
+    candidates = []
+    seen_emails, seen_cpfs = set(), set()
+    for line_no, row, error in chunk:
+        if error:
+            errors.append(_error(line_no, error))
+            continue
+        try:
+            client = schemas.ClientCreate.model_validate(row)
+        except ValidationError as e:
+            errors.append(_error(line_no, _validation_reason(e)))
+            continue
+        if client.email in seen_emails:
+            errors.append(_error(line_no, "Duplicate email in file"))
+        elif client.cpf in seen_cpfs:
+            errors.append(_error(line_no, "Duplicate CPF in file"))
+        else:
+            seen_emails.add(client.email)
+            seen_cpfs.add(client.cpf)
+            candidates.append((line_no, client))
+
+    existing_emails, existing_cpfs = await crud.find_existing_clients(db, emails=seen_emails, cpfs=seen_cpfs)
+    rows = []
+    for line_no, client in candidates:
+        if client.email in existing_emails:
+            errors.append(_error(line_no, "Email already registered"))
+        elif client.cpf in existing_cpfs:
+            errors.append(_error(line_no, "CPF already registered"))
+        else:
+            rows.append((line_no, {"name": client.name, "email": client.email, "cpf": client.cpf}))
+
+    if not rows:
+        return 0, errors
+    try:
+        inserted = (await db.execute(
+            insert(models.Client).returning(models.Client.id, models.Client.name, models.Client.email),
+            [values for _, values in rows],
+        )).all()
+        await db.commit()
+    except IntegrityError:
+        # another writer took one of the emails/cpfs after the lookup
+        await db.rollback()
+        errors.extend(_error(line_no, "Email or CPF already registered (concurrent write)") for line_no, _ in rows)
+        return 0, errors
+
+    for client_id, name, email in inserted:
+        client_index.upsert(client_id, name, email)
+    return len(inserted), errors
+
+
+async def import_clients(db: AsyncSession, records, chunk_size: int = IMPORT_CHUNK_SIZE) -> schemas.ClientImportReport:
+    report = schemas.ClientImportReport()
+    chunk = []
+
+    async def flush():
+        inserted, errors = await _import_chunk(db, chunk)
+        report.received += len(chunk)
+        report.inserted += inserted
+        report.rejected += len(errors)
+        room = MAX_REPORTED_ERRORS - len(report.errors)
+        report.errors.extend(sorted(errors, key=lambda error: error.line)[:max(room, 0)])
+        chunk.clear()
+
+    async for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+    report.errors_truncated = report.rejected > len(report.errors)
+    return report
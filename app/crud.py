@@ -1,22 +1,30 @@
+from collections import defaultdict
 from datetime import datetime
-from typing import Optional
+from decimal import Decimal
+from typing import List, Optional
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
-from . import models, schemas
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from . import ledger, models, schemas, stock, summaries  # ledger keeps orders.total_order_price in sync, stock reserves products.initial_stock, summaries the per-client totals
+from .catalog import catalog_cache
+from .pagination import paginate
+from .search import client_index
 from .security import get_password_hash
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import logging
 
 logger = logging.getLogger(__name__)
 
 # AUTH
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    return (await db.execute(select(models.User).where(models.User.username == username))).scalars().first()
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    return (await db.execute(select(models.User).where(models.User.email == email))).scalars().first()
 
-def create_user(db: Session, user: schemas.UserCreate, role_id: int):
+async def create_user(db: AsyncSession, user: schemas.UserCreate, role_id: int):
     hashed_password = get_password_hash(user.password)
     db_user = models.User(
         username=user.username,
@@ -25,57 +33,77 @@ def create_user(db: Session, user: schemas.UserCreate, role_id: int):
         role_id=role_id  # Aqui você associa o usuário ao grupo específico
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 # USERS
-def create_user(db: Session, username: str, email: str, hashed_password: str):
+async def create_user(db: AsyncSession, username: str, email: str, hashed_password: str):
     user = models.User(username=username, email=email, hashed_password=hashed_password)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user(db: AsyncSession, user_id: int):
+    return (await db.execute(select(models.User).where(models.User.id == user_id))).scalars().first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.User).offset(skip).limit(limit).all()
+async def get_users(db: AsyncSession, cursor: Optional[str] = None, limit: int = 10, role: Optional[str] = None):
+    query = select(models.User)
+    if role:
+        # ix_user_roles_role_user_id: só as linhas da função, já ordenadas por user_id
+        query = query.join(models.UserRole).where(models.UserRole.role == role)
+    return await paginate(db, query, models.User.id, cursor=cursor, limit=limit)
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    return (await db.execute(select(models.User).where(models.User.username == username))).scalars().first()
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    return (await db.execute(select(models.User).where(models.User.email == email))).scalars().first()
 
 # PERMISSIONS
-def create_permission(db: Session, name: str):
+async def create_permission(db: AsyncSession, name: str):
     permission = models.Permission(name=name)
     db.add(permission)
-    db.commit()
-    db.refresh(permission)
+    await db.commit()
+    await db.refresh(permission)
     return permission
 
-def get_permission_by_id(db: Session, permission_id: int):
-    return db.query(models.Permission).filter(models.Permission.id == permission_id).first()
+async def get_permission_by_id(db: AsyncSession, permission_id: int):
+    return (await db.execute(select(models.Permission).where(models.Permission.id == permission_id))).scalars().first()
 
-def get_permissions(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Permission).offset(skip).limit(limit).all()
+async def get_permissions(db: AsyncSession, skip: int = 0, limit: int = 10):
+    return (await db.execute(select(models.Permission).offset(skip).limit(limit))).scalars().all()
 
-def get_permission_by_name(db: Session, name: str):
-    return db.query(models.Permission).filter(models.Permission.name == name).first()
+async def get_permission_by_name(db: AsyncSession, name: str):
+    return (await db.execute(select(models.Permission).where(models.Permission.name == name))).scalars().first()
 
 # permissões de um grupo específico
-def get_permissions_by_role_id(db: Session, role_id: int):
-    role = db.query(models.Role).filter(models.Role.id == role_id).first()
+async def get_permissions_by_role_id(db: AsyncSession, role_id: int):
+    role = (await db.execute(
+        select(models.Role).options(selectinload(models.Role.permissions)).where(models.Role.id == role_id)
+    )).scalars().first()
     if not role:
         return None
     return role.permissions
 
 # CLIENTS
-def get_clients(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Client).offset(skip).limit(limit).all()
+CLIENT_SORT_COLUMNS = {"name": models.Client.name, "email": models.Client.email}
+
+async def get_clients(
+    db: AsyncSession,
+    cursor: Optional[str] = None,
+    limit: int = 10,
+    sort: Optional[str] = None,
+    name: Optional[str] = None,
+    email: Optional[str] = None,
+):
+    query = select(models.Client)
+    if name:
+        query = query.where(models.Client.name.ilike(f"%{name}%"))
+    if email:
+        query = query.where(models.Client.email.ilike(f"%{email}%"))
+    return await paginate(db, query, models.Client.id, cursor=cursor, limit=limit, sort_column=CLIENT_SORT_COLUMNS.get(sort))
 
 # def create_client(db: Session, client: schemas.ClientCreate):
 #     db_client = models.Client(name=client.name, email=client.email, cpf=client.cpf)
@@ -84,184 +112,502 @@ def get_clients(db: Session, skip: int = 0, limit: int = 10):
 #     db.refresh(db_client)
 #     return db_client
 
-def create_client(db: Session, client: schemas.ClientCreate):
+# email and cpf are checked with one query (find_existing_clients); the
+# unique indexes still catch a concurrent insert of the same values
+async def create_client(db: AsyncSession, client: schemas.ClientCreate):
+    existing_emails, existing_cpfs = await find_existing_clients(db, emails=[client.email], cpfs=[client.cpf])
+    if existing_emails:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Email already registered")
+    if existing_cpfs:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="CPF already registered")
     try:
         db_client = models.Client(name=client.name, email=client.email, cpf=client.cpf)
         db.add(db_client)
-        db.commit()
-        db.refresh(db_client)
+        await db.commit()
+        await db.refresh(db_client)
+        client_index.upsert(db_client.id, db_client.name, db_client.email)
         return db_client
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         if "duplicate key value violates unique constraint" in str(e.orig):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="CPF or email already registered")
         else:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An unexpected error occurred")
         
-def get_client(db: Session, client_id: int):
-    return db.query(models.Client).filter(models.Client.id == client_id).first()
-
-def get_client_by_name(db: Session, client_name: str):
-    return db.query(models.Client).filter(models.Client.name == client_name).first()
-
-def get_client_by_email(db: Session, client_email: str):
-    return db.query(models.Client).filter(models.Client.email == client_email).first()
-
-def get_client_by_cpf(db: Session, cpf: str):
-    return db.query(models.Client).filter(models.Client.cpf == cpf).first()
-
-def update_client(db: Session, client_id: int, client_update: schemas.ClientUpdate):
-    db_client = db.query(models.Client).filter(models.Client.id == client_id).first()
+async def get_client(db: AsyncSession, client_id: int):
+    return (await db.execute(select(models.Client).where(models.Client.id == client_id))).scalars().first()
+
+async def get_client_by_name(db: AsyncSession, client_name: str):
+    return (await db.execute(select(models.Client).where(models.Client.name == client_name))).scalars().first()
+
+async def get_client_by_email(db: AsyncSession, client_email: str):
+    return (await db.execute(select(models.Client).where(models.Client.email == client_email))).scalars().first()
+
+async def get_client_by_cpf(db: AsyncSession, cpf: str):
+    return (await db.execute(select(models.Client).where(models.Client.cpf == cpf))).scalars().first()
+
+# emails and cpfs (out of the given ones) already taken, in a single query
+async def find_existing_clients(db: AsyncSession, emails=(), cpfs=()):
+    emails, cpfs = set(emails), set(cpfs)
+    if not emails and not cpfs:
+        return set(), set()
+    rows = (await db.execute(
+        select(models.Client.email, models.Client.cpf).where(or_(models.Client.email.in_(emails), models.Client.cpf.in_(cpfs)))
+    )).all()
+    return {email for email, _ in rows if email in emails}, {cpf for _, cpf in rows if cpf in cpfs}
+
+async def update_client(db: AsyncSession, client_id: int, client_update: schemas.ClientUpdate):
+    db_client = (await db.execute(select(models.Client).where(models.Client.id == client_id))).scalars().first()
     
     if db_client:
         for key, value in client_update.dict(exclude_unset=True).items():
             setattr(db_client, key, value)
         
-        db.commit()
-        db.refresh(db_client)
+        await db.commit()
+        await db.refresh(db_client)
+        client_index.upsert(db_client.id, db_client.name, db_client.email)
     
     return db_client
 
-def delete_client(db: Session, client_id: int):
-    db_client = db.query(models.Client).filter(models.Client.id == client_id).first()
-    db.delete(db_client)
-    db.commit()
+async def delete_client(db: AsyncSession, client_id: int):
+    db_client = (await db.execute(select(models.Client).where(models.Client.id == client_id))).scalars().first()
+    await db.delete(db_client)
+    await db.commit()
+    client_index.remove(client_id)
 
 #PRODUCTS
-def get_products(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Product).offset(skip).limit(limit).all()
+PRODUCT_SORT_COLUMNS = {"description": models.Product.description, "sale_value": models.Product.sale_value}
 
-def create_product(db: Session, product: schemas.ProductCreate):
+async def get_products(db: AsyncSession, cursor: Optional[str] = None, limit: int = 10, sort: Optional[str] = None):
+    return await paginate(
+        db, select(models.Product), models.Product.id, cursor=cursor, limit=limit, sort_column=PRODUCT_SORT_COLUMNS.get(sort)
+    )
+
+async def create_product(db: AsyncSession, product: schemas.ProductCreate):
     db_product = models.Product(
         description=product.description,
         sale_value=product.sale_value,
         barcode=product.barcode,
-        section=product.section,
+        section=product.section,  # synonym of products.category
         initial_stock=product.initial_stock,
         expiry_date=product.expiry_date,
         available=product.initial_stock > 0  # Definindo o valor de available
     )
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+    await _commit_product(db)
+    catalog_cache.bump()
+    await db.refresh(db_product)
     return db_product
 
-def get_product(db: Session, product_id: int):
-    return db.query(models.Product).filter(models.Product.id == product_id).first()
+# barcode is unique (ix_products_barcode)
+async def _commit_product(db: AsyncSession):
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Barcode already registered")
 
-def update_product(db: Session, product_id: int, product_update: schemas.ProductUpdate):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+async def get_product(db: AsyncSession, product_id: int):
+    return (await db.execute(select(models.Product).where(models.Product.id == product_id))).scalars().first()
+
+async def update_product(db: AsyncSession, product_id: int, product_update: schemas.ProductUpdate):
+    db_product = (await db.execute(select(models.Product).where(models.Product.id == product_id))).scalars().first()
     
     if db_product:
         for key, value in product_update.dict(exclude_unset=True).items():
             setattr(db_product, key, value)
+        if db_product.initial_stock is not None:
+            db_product.available = db_product.initial_stock > 0
         
-        db.commit()
-        db.refresh(db_product)
+        await _commit_product(db)
+        catalog_cache.bump()
+        await db.refresh(db_product)
     
     return db_product
 
-def delete_product(db: Session, product_id: int):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+async def delete_product(db: AsyncSession, product_id: int):
+    db_product = (await db.execute(select(models.Product).where(models.Product.id == product_id))).scalars().first()
     if db_product:
-        db.delete(db_product)
-        db.commit()
+        await db.delete(db_product)
+        await db.commit()
+        catalog_cache.bump()
         return db_product
     raise HTTPException(404, detail="Product not found")
 
+# catalog sync: products are matched by barcode (ix_products_barcode, unique)
+PRODUCT_UPSERT_BATCH_SIZE = 1000
+PRODUCT_UPSERT_COLUMNS = ("description", "sale_value", "category", "initial_stock", "expiry_date", "available")
+
+def _upsert_insert(dialect_name: str):
+    if dialect_name == "postgresql":
+        return postgresql.insert
+    if dialect_name == "sqlite":
+        return sqlite.insert
+    raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=f"Upsert not supported on {dialect_name}")
+
+def _product_row(product: schemas.ProductCreate) -> dict:
+    return {
+        "barcode": product.barcode,
+        "description": product.description,
+        "sale_value": product.sale_value,
+        "category": product.section,
+        "initial_stock": product.initial_stock,
+        "expiry_date": product.expiry_date,
+        "available": product.initial_stock > 0,
+    }
+
+# one SELECT per batch classifies the rows; new and changed rows then go in a
+# single INSERT ... ON CONFLICT (barcode) DO UPDATE, which also covers rows
+# inserted concurrently after the SELECT. Unchanged rows are not written.
+async def upsert_products(db: AsyncSession, products: List[schemas.ProductCreate], batch_size: int = PRODUCT_UPSERT_BATCH_SIZE):
+    # the same barcode twice in one request: the last one wins
+    rows = {}
+    for product in products:
+        rows[product.barcode] = _product_row(product)
+    report = schemas.ProductUpsertReport(received=len(products), duplicates=len(products) - len(rows))
+
+    insert_for_dialect = _upsert_insert(db.get_bind().dialect.name)
+    pending = list(rows.values())
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        existing = {
+            row.barcode: row
+            for row in (await db.execute(
+                select(models.Product.barcode, *(getattr(models.Product, column) for column in PRODUCT_UPSERT_COLUMNS))
+                .where(models.Product.barcode.in_([row["barcode"] for row in batch]))
+            )).all()
+        }
+        changed = []
+        for row in batch:
+            current = existing.get(row["barcode"])
+            if current is None:
+                report.inserted += 1
+            elif any(getattr(current, column) != row[column] for column in PRODUCT_UPSERT_COLUMNS):
+                report.updated += 1
+            else:
+                report.unchanged += 1
+                continue
+            changed.append(row)
+
+        if changed:
+            stmt = insert_for_dialect(models.Product).values(changed)
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=[models.Product.barcode],
+                set_={column: stmt.excluded[column] for column in PRODUCT_UPSERT_COLUMNS},
+            ))
+        await db.commit()
+        if changed:
+            catalog_cache.bump()
+    return report
+
 # ORDERS
-def get_orders(db: Session, skip: int = 0, limit: int = 10):
-    orders = db.query(models.Order).offset(skip).limit(limit).all()    
-    for order in orders:
-        total_price = 0.0
-        for item in order.items:
-            total_price += item.total_price
-        order.total_order_price = total_price
-    return orders
-
-def get_order(db: Session, order_id: int):
+# items and products are loaded in batches (selectin), so a page of orders
+# costs a fixed number of queries regardless of its size
+def _orders_with_items():
+    return select(models.Order).options(
+        selectinload(models.Order.items).selectinload(models.OrderItem.product)
+    )
+
+# total_order_price is maintained by the ledger on every item write,
+# so reads use the stored column
+async def get_orders(db: AsyncSession, cursor: Optional[str] = None, limit: int = 10):
+    return await paginate(db, _orders_with_items(), models.Order.id, cursor=cursor, limit=limit)
+
+async def get_order(db: AsyncSession, order_id: int):
     logger.info(f"Fetching order with ID: {order_id}")
-    return db.query(models.Order).filter(models.Order.id == order_id).first()
-
-def create_order(db: Session, order: schemas.OrderCreate):
-    # create order
-    db_order = models.Order(client_id=order.client_id, status=order.status)
-    db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
-    
-    # add items order
-    for item in order.items:
-        db_item = models.OrderItem(order_id=db_order.id, product_id=item.product_id, quantity=item.quantity)
-        db.add(db_item)
-    db.commit()
-
-    # update and return order with items
-    db.refresh(db_order)
-    return db_order
-
-def update_order(db: Session, order_id: int, order_update: schemas.OrderUpdate):
-    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
-    if db_order:
-        if order_update.client_id:
-            db_order.client_id = order_update.client_id
-        if order_update.status:
-            db_order.status = order_update.status
-        
-        # update items order
-        if order_update.items:
-            for item_update in order_update.items:
-                db_item = db.query(models.OrderItem).filter(
-                    models.OrderItem.product_id == item_update.product_id,
-                    models.OrderItem.order_id == order_id
-                ).first()
-                if db_item:
-                    db_item.quantity = item_update.quantity
-                    db_item.updated_at = datetime.utcnow()
-        
-        # update total price order
-        db_order.update_total_order_price()
-        db.commit()
-        db.refresh(db_order)
-    return db_order
-
-def delete_order(db: Session, order_id: int) -> Optional[schemas.Order]:
-    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    return (await db.execute(
+        _orders_with_items().where(models.Order.id == order_id).execution_options(populate_existing=True)
+    )).scalars().first()
+
+# a client's order history, newest ids last: the keyset walks ix_orders_client_id_id
+async def get_client_orders(db: AsyncSession, client_id: int, cursor: Optional[str] = None, limit: int = 10):
+    return await paginate(
+        db, _orders_with_items().where(models.Order.client_id == client_id), models.Order.id, cursor=cursor, limit=limit
+    )
+
+# the client joined with its summary row (both by primary key); None when the
+# client does not exist, zeros when it has no orders yet
+async def get_client_summary(db: AsyncSession, client_id: int) -> Optional[schemas.ClientSummary]:
+    row = (await db.execute(
+        select(models.Client.id, models.ClientSummary.order_count, models.ClientSummary.lifetime_value, models.ClientSummary.last_order_at)
+        .outerjoin(models.ClientSummary, models.ClientSummary.client_id == models.Client.id)
+        .where(models.Client.id == client_id)
+    )).first()
+    if row is None:
+        return None
+    order_count, lifetime_value = row.order_count or 0, ledger.to_decimal(row.lifetime_value)
+    return schemas.ClientSummary(
+        client_id=row.id,
+        order_count=order_count,
+        lifetime_value=lifetime_value,
+        average_ticket=(lifetime_value / order_count).quantize(Decimal("0.01")) if order_count else Decimal(0),
+        last_order_at=row.last_order_at,
+    )
+
+# Inserts orders and their items without committing: one query for the
+# referenced clients, one for the product prices, the stock reservation of
+# the whole batch (stock.reserve_orders), one multi-row INSERT for the orders and one batched INSERT for all the items.
+# The rows are written with Core-style inserts that bypass the flush hooks,
+# so totals, stock and the client summaries are handled here. Returns [(order_id, None) |
+# (None, HTTPException)] in input order.
+async def _insert_orders(db: AsyncSession, orders: List[schemas.OrderCreate]):
+    client_ids = {order.client_id for order in orders}
+    product_ids = {item.product_id for order in orders for item in order.items}
+    known_clients = set((await db.execute(
+        select(models.Client.id).where(models.Client.id.in_(client_ids))
+    )).scalars()) if client_ids else set()
+    prices = {product_id: ledger.to_decimal(price) for product_id, price in (await db.execute(
+        select(models.Product.id, models.Product.sale_value).where(models.Product.id.in_(product_ids))
+    )).all()} if product_ids else {}
+
+    results = [None] * len(orders)
+    valid = []
+    for index, order in enumerate(orders):
+        missing = sorted({item.product_id for item in order.items} - prices.keys())
+        if order.client_id not in known_clients:
+            results[index] = (None, HTTPException(status.HTTP_404_NOT_FOUND, detail=f"Client {order.client_id} not found"))
+        elif missing:
+            results[index] = (None, HTTPException(status.HTTP_404_NOT_FOUND, detail=f"Product {missing[0]} not found"))
+        else:
+            valid.append(index)
+
+    # the stock of all the orders is reserved at once; each order gets all of
+    # its stock or none of it (an order that does not fit gets a 409)
+    shortages = await db.run_sync(stock.reserve_orders, [stock.order_quantities(orders[index]) for index in valid])
+    reserved = []
+    for index, shortage in zip(valid, shortages):
+        if shortage is not None:
+            results[index] = (None, shortage)
+        else:
+            reserved.append(index)
+    valid = reserved
+    if not valid:
+        return results
+
+    order_rows = []
+    created_at = datetime.utcnow()
+    for index in valid:
+        order = orders[index]
+        total = sum((item.quantity * prices[item.product_id] for item in order.items), Decimal(0))
+        order_rows.append({
+            "client_id": order.client_id,
+            "status": order.status,
+            "total_order_price": total.quantize(Decimal("0.01")),
+            "created_at": created_at,
+        })
+    # ids come back in parameter order; Postgres does this in multi-row
+    # batches (insertmanyvalues), SQLite falls back to one row per statement
+    order_ids = (await db.execute(
+        insert(models.Order).returning(models.Order.id, sort_by_parameter_order=True), order_rows
+    )).scalars().all()
+
+    item_rows = []
+    for index, order_id in zip(valid, order_ids):
+        results[index] = (order_id, None)
+        item_rows.extend(
+            {"order_id": order_id, "product_id": item.product_id, "quantity": item.quantity, "unit_price": prices[item.product_id]}
+            for item in orders[index].items
+        )
+    if item_rows:
+        await db.execute(insert(models.OrderItem), item_rows)
+
+    client_deltas = summaries.client_deltas()
+    for row in order_rows:
+        summaries.add_order(client_deltas, row["client_id"], row["total_order_price"], created_at)
+    await db.run_sync(summaries.apply_client_deltas, client_deltas)
+    return results
+
+async def create_order(db: AsyncSession, order: schemas.OrderCreate):
+    [(order_id, error)] = await _insert_orders(db, [order])
+    if error:
+        await db.rollback()
+        raise error
+    await db.commit()
+
+    # return order with items
+    return await get_order(db, order_id)
+
+# POS sync: orders are written in chunks, one transaction per chunk; invalid
+# orders are reported and skipped without failing the rest of their chunk
+BULK_ORDER_CHUNK_SIZE = 500
+
+async def create_orders_bulk(db: AsyncSession, orders: List[schemas.OrderCreate], chunk_size: int = BULK_ORDER_CHUNK_SIZE):
+    results = []
+    for start in range(0, len(orders), chunk_size):
+        chunk = orders[start:start + chunk_size]
+        try:
+            inserted = await _insert_orders(db, chunk)
+            await db.commit()
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Bulk order chunk starting at {start} failed: {e}")
+            inserted = [(None, HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error, chunk rolled back"))] * len(chunk)
+        for offset, (order_id, error) in enumerate(inserted):
+            results.append(schemas.OrderBulkResult(
+                index=start + offset,
+                id=order_id,
+                status="error" if error else "created",
+                detail=error.detail if error else None,
+            ))
+    created = sum(1 for result in results if result.id is not None)
+    return schemas.OrderBulkResponse(created=created, failed=len(results) - created, results=results)
+
+# PUT semantics for the items: the list replaces the order's items. The
+# current items are loaded once and keyed by product_id, the new list is
+# diffed against them and the result is written with one bulk INSERT, one
+# bulk UPDATE and one DELETE; stock and the order total are adjusted
+# explicitly from the same diff, and so is the client summary (the bulk
+# statements bypass the flush hooks).
+# The number of round trips does not depend on the number of lines.
+async def update_order(db: AsyncSession, order_id: int, order_update: schemas.OrderUpdate):
+    db_order = (await db.execute(
+        select(models.Order).options(selectinload(models.Order.items)).where(models.Order.id == order_id)
+    )).scalars().first()
+    if db_order is None:
+        return None
+
+    values = {}
+    total_delta = Decimal(0)
+    if order_update.client_id and order_update.client_id != db_order.client_id:
+        client = (await db.execute(
+            select(models.Client.id).where(models.Client.id == order_update.client_id)
+        )).scalar()
+        if client is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f"Client {order_update.client_id} not found")
+        values["client_id"] = order_update.client_id
+    if order_update.status:
+        values["status"] = order_update.status
+
+    if order_update.items is not None:
+        current = {}
+        to_delete = []
+        for item in db_order.items:
+            # a product repeated in the order collapses into its first line
+            if item.product_id in current:
+                to_delete.append(item)
+            else:
+                current[item.product_id] = item
+        wanted = {item.product_id: item.quantity for item in order_update.items}
+
+        # existing lines are worth the unit_price they were booked at; only
+        # the new lines take the product's current price
+        to_insert, to_update, quantity_deltas = [], [], defaultdict(int)
+        for item in to_delete:
+            quantity_deltas[item.product_id] -= item.quantity or 0
+            total_delta -= (item.quantity or 0) * ledger.to_decimal(item.unit_price)
+        for product_id, item in current.items():
+            if product_id not in wanted:
+                to_delete.append(item)
+                quantity_deltas[product_id] -= item.quantity or 0
+                total_delta -= (item.quantity or 0) * ledger.to_decimal(item.unit_price)
+        for product_id, quantity in wanted.items():
+            item = current.get(product_id)
+            if item is None:
+                if quantity is None:
+                    raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=f"Quantity required for new product {product_id}")
+                to_insert.append({"order_id": order_id, "product_id": product_id, "quantity": quantity})
+                quantity_deltas[product_id] += quantity
+            elif quantity is not None and quantity != item.quantity:
+                to_update.append({"id": item.id, "quantity": quantity, "updated_at": datetime.utcnow()})
+                quantity_deltas[product_id] += quantity - (item.quantity or 0)
+                total_delta += (quantity - (item.quantity or 0)) * ledger.to_decimal(item.unit_price)
+
+        if to_insert:
+            prices = {product_id: ledger.to_decimal(price) for product_id, price in (await db.execute(
+                select(models.Product.id, models.Product.sale_value)
+                .where(models.Product.id.in_([row["product_id"] for row in to_insert]))
+            )).all()}
+            missing = sorted({row["product_id"] for row in to_insert} - prices.keys())
+            if missing:
+                raise HTTPException(status.HTTP_404_NOT_FOUND, detail=f"Product {missing[0]} not found")
+            for row in to_insert:
+                row["unit_price"] = prices[row["product_id"]]
+                total_delta += row["quantity"] * row["unit_price"]
+
+        quantity_deltas = {product_id: delta for product_id, delta in quantity_deltas.items() if delta}
+        if quantity_deltas:
+            await db.run_sync(stock.apply_stock_deltas, quantity_deltas)
+        if total_delta:
+            values["total_order_price"] = func.coalesce(models.Order.total_order_price, 0) + total_delta
+
+        if to_insert:
+            await db.execute(insert(models.OrderItem), to_insert)
+        if to_update:
+            await db.execute(update(models.OrderItem), to_update)
+        if to_delete:
+            await db.execute(
+                delete(models.OrderItem)
+                .where(models.OrderItem.id.in_([item.id for item in to_delete]))
+                .execution_options(synchronize_session=False)
+            )
+
+    if values:
+        await db.execute(
+            update(models.Order).where(models.Order.id == order_id).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+
+        client_deltas = summaries.client_deltas()
+        client_id = values.get("client_id", db_order.client_id)
+        if client_id != db_order.client_id:
+            old_total = ledger.to_decimal(db_order.total_order_price)
+            summaries.remove_order(client_deltas, db_order.client_id, old_total)
+            summaries.add_order(client_deltas, client_id, old_total + total_delta, db_order.created_at)
+        elif total_delta:
+            summaries.add_value(client_deltas, client_id, total_delta)
+        await db.run_sync(summaries.apply_client_deltas, client_deltas)
+    await db.commit()
+    return await get_order(db, order_id)
+
+async def delete_order(db: AsyncSession, order_id: int) -> Optional[schemas.Order]:
+    db_order = (await db.execute(
+        select(models.Order).options(selectinload(models.Order.items)).where(models.Order.id == order_id)
+    )).scalars().first()
     if db_order:
-        db.delete(db_order)
-        db.commit()
+        # the items go with the order, giving their stock back
+        for item in db_order.items:
+            await db.delete(item)
+        await db.delete(db_order)
+        await db.commit()
         return db_order
     return None
 
 # ORDER ITEM
-def create_order_item(db: Session, order_id: int, order_item: schemas.OrderItemCreate):
+# total_price comes from the unit_price booked on the line (no product load)
+async def _load_order_item(db: AsyncSession, item_id: int):
+    return (await db.execute(
+        select(models.OrderItem)
+        .where(models.OrderItem.id == item_id)
+        .execution_options(populate_existing=True)
+    )).scalars().first()
+
+async def create_order_item(db: AsyncSession, order_id: int, order_item: schemas.OrderItemCreate):
     db_order_item = models.OrderItem(**order_item.dict(), order_id=order_id)
     db.add(db_order_item)
-    db.commit()
-    db.refresh(db_order_item)
-    return db_order_item
+    await db.commit()
+    return await _load_order_item(db, db_order_item.id)
 
-def get_order_item(db: Session, item_id: int):
+async def get_order_item(db: AsyncSession, item_id: int):
     logger.info(f"Fetching order item with ID: {item_id}")
-    return db.query(models.OrderItem).filter(models.OrderItem.id == item_id).first()
+    return await _load_order_item(db, item_id)
 
-def get_order_item_by_product_id(db: Session, product_id: int):
+async def get_order_item_by_product_id(db: AsyncSession, product_id: int):
     logger.info(f"Fetching order item with Product ID: {product_id}")
-    return db.query(models.OrderItem).filter(models.OrderItem.product_id == product_id).first()
+    return (await db.execute(select(models.OrderItem).where(models.OrderItem.product_id == product_id))).scalars().first()
 
-def update_order_item(db: Session, item_id: int, order_item_update: schemas.OrderItemUpdate):
-    db_order_item = db.query(models.OrderItem).filter(models.OrderItem.id == item_id).first()
+async def update_order_item(db: AsyncSession, item_id: int, order_item_update: schemas.OrderItemUpdate):
+    db_order_item = await _load_order_item(db, item_id)
     if db_order_item:
         for key, value in order_item_update.dict(exclude_unset=True).items():
             setattr(db_order_item, key, value)
-        db.commit()
-        db.refresh(db_order_item)
+        await db.commit()
+        db_order_item = await _load_order_item(db, item_id)
     return db_order_item
 
-def delete_order_item(db: Session, item_id: int):
-    db_order_item = db.query(models.OrderItem).filter(models.OrderItem.id == item_id).first()
+async def delete_order_item(db: AsyncSession, item_id: int):
+    db_order_item = await _load_order_item(db, item_id)
     if db_order_item:
-        db.delete(db_order_item)
-        db.commit()
+        await db.delete(db_order_item)
+        await db.commit()
         return db_order_item
     return None
\ No newline at end of file
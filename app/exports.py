@@ -0,0 +1,102 @@
+import csv
+import io
+import json
+from collections import defaultdict
+
+from sqlalchemy import select
+
+from . import models
+from .replicas import read_session
+
+EXPORT_BATCH_SIZE = 1000
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+CLIENT_COLUMNS = ["id", "name", "email", "cpf"]
+ORDER_COLUMNS = ["id", "client_id", "status", "total_order_price"]
+ORDER_ITEM_COLUMNS = ["item_id", "product_id", "quantity", "unit_price", "total_price"]
+
+# The generators below open their own session: FastAPI closes the request's
+# get_db session before a StreamingResponse body is sent. Rows come from a
+# server-side cursor (yield_per) one partition at a time, and each partition
+# is encoded and sent before the next is fetched, so memory does not grow
+# with the table.
+
+
+def _ndjson(rows) -> str:
+    return "".join(json.dumps(row, default=str) + "\n" for row in rows)
+
+
+def _csv(rows, header=None) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+async def stream_clients(fmt: str = "ndjson", batch_size: int = EXPORT_BATCH_SIZE):
+    if fmt == "csv":
+        yield _csv([], header=CLIENT_COLUMNS)
+    async with read_session() as db:
+        result = await db.stream(
+            select(models.Client.id, models.Client.name, models.Client.email, models.Client.cpf)
+            .order_by(models.Client.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions():
+            if fmt == "csv":
+                yield _csv(partition)
+            else:
+                yield _ndjson(dict(zip(CLIENT_COLUMNS, row)) for row in partition)
+
+
+# items of a batch of orders in one query (unit price booked on the line)
+async def _items_by_order(db, order_ids):
+    rows = (await db.execute(
+        select(
+            models.OrderItem.order_id,
+            models.OrderItem.id,
+            models.OrderItem.product_id,
+            models.OrderItem.quantity,
+            models.OrderItem.unit_price,
+        )
+        .where(models.OrderItem.order_id.in_(order_ids))
+        .order_by(models.OrderItem.order_id, models.OrderItem.id)
+    )).all()
+    items = defaultdict(list)
+    for order_id, item_id, product_id, quantity, unit_price in rows:
+        unit_price = float(unit_price or 0)
+        items[order_id].append([item_id, product_id, quantity, unit_price, (quantity or 0) * unit_price])
+    return items
+
+
+# NDJSON: one order per line with its items nested; CSV: one line per item
+# (the order columns repeat), orders without items get one line with empty item columns
+async def stream_orders(fmt: str = "ndjson", batch_size: int = EXPORT_BATCH_SIZE):
+    if fmt == "csv":
+        yield _csv([], header=ORDER_COLUMNS + ORDER_ITEM_COLUMNS)
+    async with read_session() as db:
+        result = await db.stream(
+            select(models.Order.id, models.Order.client_id, models.Order.status, models.Order.total_order_price)
+            .order_by(models.Order.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for partition in result.partitions():
+            items = await _items_by_order(db, [row.id for row in partition])
+            orders = [[order_id, client_id, status, float(total or 0)] for order_id, client_id, status, total in partition]
+            if fmt == "csv":
+                yield _csv(
+                    order + item
+                    for order in orders
+                    for item in (items.get(order[0]) or [[None] * len(ORDER_ITEM_COLUMNS)])
+                )
+            else:
+                yield _ndjson(
+                    {
+                        **dict(zip(ORDER_COLUMNS, order)),
+                        "items": [dict(zip(ORDER_ITEM_COLUMNS, item)) for item in items.get(order[0], [])],
+                    }
+                    for order in orders
+                )
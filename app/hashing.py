@@ -0,0 +1,108 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+# single context for the whole app: new hashes are bcrypt with BCRYPT_ROUNDS;
+# sha256_crypt hashes (from the old security.py context) and bcrypt hashes
+# with fewer rounds still verify, and are flagged for rehash on login
+pwd_context = CryptContext(
+    schemes=["bcrypt", "sha256_crypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+
+def _verify_and_update(password: str, hashed_password: str):
+    try:
+        return pwd_context.verify_and_update(password, hashed_password)
+    except ValueError:  # hash in an unknown format
+        return False, None
+
+
+# bcrypt costs tens of milliseconds of CPU per call. It runs on a small
+# dedicated thread pool (the bcrypt module releases the GIL) so it neither
+# blocks the event loop nor starves the default executor; when too many calls
+# are pending the request is rejected with 503 instead of queueing forever.
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self.pending = 0  # queued + running
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self.pending - self.running, 0)
+
+    async def _submit(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, try again later",
+                headers={"Retry-After": "1"},
+            )
+
+        enqueued = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            with self._lock:
+                self.running += 1
+                self.wait_seconds += started - enqueued
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.run_seconds += time.perf_counter() - started
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, task)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(pwd_context.hash, password)
+
+    # (valid, new_hash): new_hash is set when the stored hash uses an old scheme or cost
+    async def verify(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        if not hashed_password:
+            return False, None
+        return await self._submit(_verify_and_update, password, hashed_password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "running": self.running,
+                "queue_depth": self.queue_depth,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_seconds_sum": round(self.wait_seconds, 6),
+                "run_seconds_sum": round(self.run_seconds, 6),
+            }
+
+
+password_hasher = PasswordHasher()
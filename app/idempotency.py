@@ -0,0 +1,346 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from fastapi import status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from . import database, models
+
+logger = logging.getLogger(__name__)
+
+# how long a stored response is replayed for the same key
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# how long a retry waits for the first request with its key to finish
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+# lease of an in-progress key: renewed while the request runs (every third of
+# it), so only a key left behind by a crashed process expires and becomes
+# usable again
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", "60"))
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL", "0.05"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "300"))
+IDEMPOTENT_PATHS = os.getenv("IDEMPOTENT_PATHS", "/orders,/orders/bulk,/clients")
+
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    request_hash: str
+    status_code: int
+    headers: Tuple[Tuple[bytes, bytes], ...]
+    body: bytes
+    expires_at: datetime
+
+    @classmethod
+    def from_row(cls, row: models.IdempotencyKey) -> "StoredResponse":
+        headers = tuple((name.encode("latin-1"), value.encode("latin-1")) for name, value in row.headers or ())
+        return cls(row.request_hash, row.status_code, headers, row.body or b"", row.expires_at)
+
+
+# in-memory front of the idempotency_keys table: TTL + LRU of the finished
+# responses, so replays served by this process do not touch the database
+class ResponseCache:
+    def __init__(self, max_size: int = IDEMPOTENCY_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> StoredResponse
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        stored = self._entries.get(key)
+        if stored is None or stored.expires_at <= datetime.utcnow():
+            if stored is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return stored
+
+    def put(self, key: str, stored: StoredResponse):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = stored
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def _scope_key(method: str, path: str, authorization: bytes, idempotency_key: bytes) -> str:
+    # the same key sent by different callers (or to another endpoint) is a different request
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), authorization, idempotency_key):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+async def _read_body(receive) -> Tuple[bytes, list]:
+    messages, chunks = [], []
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks), messages
+
+
+def _error(status_code: int, detail: str, headers: dict = None) -> ORJSONResponse:
+    return ORJSONResponse({"detail": detail}, status_code=status_code, headers=headers)
+
+
+# Idempotency-Key support for the POST endpoints in IDEMPOTENT_PATHS.
+#
+# The first request with a key claims it by inserting an in-progress row into
+# idempotency_keys (the primary key makes the claim atomic across processes),
+# runs normally and stores its response; retries with the same key get that
+# response back (with Idempotent-Replayed: true) without running the endpoint.
+# A retry that arrives while the first request is still running waits for it:
+# on an asyncio.Event in the same process, by polling the row otherwise.
+# 5xx responses and exceptions release the key so the client can retry.
+class IdempotencyMiddleware:
+    def __init__(self, app, paths: str = IDEMPOTENT_PATHS, ttl: float = IDEMPOTENCY_TTL,
+                 wait_timeout: float = IDEMPOTENCY_WAIT_TIMEOUT, lease: float = IDEMPOTENCY_LEASE,
+                 cache: ResponseCache = None):
+        self.app = app
+        self.paths = frozenset(path.strip().rstrip("/") for path in paths.split(",") if path.strip())
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.lease = lease
+        self.cache = cache if cache is not None else response_cache
+        self._in_flight = {}  # key -> asyncio.Event
+        self._last_purge = time.monotonic()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"].rstrip("/") not in self.paths:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(b"idempotency-key")
+        if idempotency_key is None:
+            return await self.app(scope, receive, send)
+        if not idempotency_key.strip() or len(idempotency_key) > MAX_KEY_LENGTH:
+            response = _error(status.HTTP_400_BAD_REQUEST, f"Idempotency-Key must have 1 to {MAX_KEY_LENGTH} characters")
+            return await response(scope, receive, send)
+
+        body, messages = await _read_body(receive)
+        request_hash = hashlib.sha256(body).hexdigest()
+        key = _scope_key(scope["method"], scope["path"], headers.get(b"authorization", b""), idempotency_key)
+
+        async def replay_body():
+            return messages.pop(0) if messages else await receive()
+
+        # same process: wait for the request that holds the key
+        while True:
+            stored = self.cache.get(key)
+            if stored is not None:
+                return await self._replay(stored, request_hash, scope, replay_body, send)
+            pending = self._in_flight.get(key)
+            if pending is None:
+                break
+            stats.waits += 1
+            try:
+                await asyncio.wait_for(pending.wait(), self.wait_timeout)
+            except asyncio.TimeoutError:
+                return await self._in_progress(scope, replay_body, send)
+
+        done = asyncio.Event()
+        self._in_flight[key] = done
+        try:
+            row = await self._claim(key, request_hash)
+            if row is None:
+                await self._execute(key, request_hash, scope, replay_body, send)
+            elif row.status_code is None:
+                await self._in_progress(scope, replay_body, send)
+            else:
+                stored = StoredResponse.from_row(row)
+                self.cache.put(key, stored)
+                await self._replay(stored, request_hash, scope, replay_body, send)
+        finally:
+            del self._in_flight[key]
+            done.set()
+
+    async def _replay(self, stored: StoredResponse, request_hash: str, scope, receive, send):
+        if stored.request_hash != request_hash:
+            stats.mismatches += 1
+            response = _error(status.HTTP_422_UNPROCESSABLE_ENTITY, "Idempotency-Key was already used with a different request body")
+            return await response(scope, receive, send)
+        stats.replays += 1
+        await send({"type": "http.response.start", "status": stored.status_code, "headers": [*stored.headers, REPLAYED_HEADER]})
+        await send({"type": "http.response.body", "body": stored.body})
+
+    async def _in_progress(self, scope, receive, send):
+        stats.conflicts += 1
+        response = _error(
+            status.HTTP_409_CONFLICT, "A request with this Idempotency-Key is still being processed",
+            headers={"Retry-After": "1"},
+        )
+        await response(scope, receive, send)
+
+    # None when this request now owns the key; otherwise the row of the
+    # request that owns it (finished, or still in progress after the wait)
+    async def _claim(self, key: str, request_hash: str) -> Optional[models.IdempotencyKey]:
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            async with database.SessionLocal() as db:
+                now = datetime.utcnow()
+                db.add(models.IdempotencyKey(
+                    key=key, request_hash=request_hash, created_at=now,
+                    expires_at=now + timedelta(seconds=self.lease),
+                ))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    await db.rollback()
+                else:
+                    await self._purge_expired(db, now)
+                    return None
+                row = (await db.execute(
+                    select(models.IdempotencyKey).where(models.IdempotencyKey.key == key)
+                )).scalar_one_or_none()
+                if row is not None and row.expires_at <= now:
+                    # expired response, or the lease of a request that never finished
+                    await db.execute(delete(models.IdempotencyKey).where(
+                        models.IdempotencyKey.key == key, models.IdempotencyKey.expires_at <= now
+                    ))
+                    await db.commit()
+                    continue
+                if row is None:
+                    continue  # released in the meantime
+                if row.status_code is not None or row.request_hash != request_hash:
+                    stats.database_hits += 1
+                    return row
+            if time.monotonic() >= deadline:
+                return row
+            stats.waits += 1
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+    async def _execute(self, key: str, request_hash: str, scope, receive, send):
+        response = {"status": None, "headers": [], "body": []}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        renewal = asyncio.create_task(self._renew_lease(key))
+        try:
+            try:
+                await self.app(scope, receive, capture)
+            finally:
+                renewal.cancel()
+        except BaseException:
+            await self._release(key)
+            raise
+        if response["status"] is None or response["status"] >= 500:
+            return await self._release(key)
+
+        stored = StoredResponse(
+            request_hash=request_hash,
+            status_code=response["status"],
+            headers=tuple(response["headers"]),
+            body=b"".join(response["body"]),
+            expires_at=datetime.utcnow() + timedelta(seconds=self.ttl),
+        )
+        try:
+            async with database.SessionLocal() as db:
+                await db.execute(
+                    update(models.IdempotencyKey)
+                    .where(models.IdempotencyKey.key == key)
+                    .values(
+                        status_code=stored.status_code,
+                        headers=[[name.decode("latin-1"), value.decode("latin-1")] for name, value in stored.headers],
+                        body=stored.body,
+                        expires_at=stored.expires_at,
+                    )
+                )
+                await db.commit()
+        except Exception:
+            # the response has been sent already; retries will run the request again
+            logger.exception("could not store the response for an idempotency key")
+            return await self._release(key)
+        stats.stored += 1
+        self.cache.put(key, stored)
+
+    # keeps the key claimed while a long request (a big bulk) runs
+    async def _renew_lease(self, key: str):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                async with database.SessionLocal() as db:
+                    await db.execute(
+                        update(models.IdempotencyKey)
+                        .where(models.IdempotencyKey.key == key, models.IdempotencyKey.status_code.is_(None))
+                        .values(expires_at=datetime.utcnow() + timedelta(seconds=self.lease))
+                    )
+                    await db.commit()
+            except Exception:
+                logger.exception("could not renew an idempotency key lease")
+
+    async def _release(self, key: str):
+        try:
+            async with database.SessionLocal() as db:
+                await db.execute(delete(models.IdempotencyKey).where(
+                    models.IdempotencyKey.key == key, models.IdempotencyKey.status_code.is_(None)
+                ))
+                await db.commit()
+        except Exception:
+            logger.exception("could not release an idempotency key")  # the lease expires on its own
+
+    # housekeeping after a successful claim: a failure is logged, the claim stands
+    async def _purge_expired(self, db, now: datetime):
+        if time.monotonic() - self._last_purge < IDEMPOTENCY_PURGE_INTERVAL:
+            return
+        self._last_purge = time.monotonic()
+        try:
+            result = await db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= now))
+            await db.commit()
+        except Exception:
+            logger.exception("could not purge expired idempotency keys")
+            return
+        stats.purged += result.rowcount or 0
+
+
+class IdempotencyStats:
+    def __init__(self):
+        self.replays = 0
+        self.stored = 0
+        self.waits = 0
+        self.conflicts = 0
+        self.mismatches = 0
+        self.database_hits = 0
+        self.purged = 0
+
+    def snapshot(self) -> dict:
+        return {**vars(self), "cache": response_cache.stats()}
+
+
+response_cache = ResponseCache()
+stats = IdempotencyStats()
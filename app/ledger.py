@@ -0,0 +1,164 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+from . import models, summaries
+
+# orders.total_order_price is kept up to date by deltas: every flush that
+# inserts, updates or deletes OrderItem rows adds (new - old) quantity * unit_price
+# to the affected orders, so readers can trust the stored column. unit_price
+# is the product's sale_value when the line was written (booked here for the
+# ORM paths, by crud for the Core ones), so a later price change does not
+# change what editing or removing the line is worth. The same deltas go to
+# the clients' summaries (app/summaries.py).
+
+
+# order total as computed from its items (used to reconcile the stored value)
+def computed_order_total():
+    return (
+        select(func.coalesce(func.sum(models.OrderItem.quantity * models.OrderItem.unit_price), 0))
+        .where(models.OrderItem.order_id == models.Order.id)
+        .correlate(models.Order)
+        .scalar_subquery()
+    )
+
+
+def to_decimal(value) -> Decimal:
+    return Decimal(str(value or 0))
+
+
+# value of the attribute before the pending changes (also used by app/summaries.py)
+def committed(state, key):
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return None
+
+
+def _current_order(state, item):
+    # the order may be set through order_id or through the relationship
+    # (e.g. order.items.remove(item)); the FK is only synced at flush time
+    if state.attrs.order_id.history.has_changes():
+        return item.order_id
+    order_history = state.attrs.order.history
+    if order_history.has_changes():
+        return order_history.added[0] if order_history.added else None
+    if item.order_id is None and "order" in item.__dict__:
+        return item.order
+    return item.order_id
+
+
+# (order, product_id, quantity, unit_price) contributions of the pending item
+# changes; order is either an order id or an Order instance not flushed yet
+def item_changes(session: Session):
+    changes = []
+    for item in session.new:
+        if isinstance(item, models.OrderItem):
+            changes.append((_current_order(inspect(item), item), item.product_id, item.quantity or 0, item.unit_price))
+
+    for item in session.deleted:
+        if isinstance(item, models.OrderItem):
+            state = inspect(item)
+            changes.append((
+                committed(state, "order_id"), committed(state, "product_id"),
+                -(committed(state, "quantity") or 0), committed(state, "unit_price"),
+            ))
+
+    for item in session.dirty:
+        if not isinstance(item, models.OrderItem) or not session.is_modified(item):
+            continue
+        state = inspect(item)
+        old = (
+            committed(state, "order_id"), committed(state, "product_id"),
+            committed(state, "quantity") or 0, committed(state, "unit_price"),
+        )
+        new = (_current_order(state, item), item.product_id, item.quantity or 0, item.unit_price)
+        if old != new:
+            changes.append((old[0], old[1], -old[2], old[3]))
+            changes.append(new)
+
+    return [change for change in changes if change[0] is not None and change[1] is not None]
+
+
+def product_prices(session: Session, product_ids) -> dict:
+    if not product_ids:
+        return {}
+    with session.no_autoflush:
+        rows = session.execute(
+            select(models.Product.id, models.Product.sale_value).where(models.Product.id.in_(set(product_ids)))
+        ).all()
+    return {product_id: to_decimal(price) for product_id, price in rows}
+
+
+# new lines, and lines moved to another product, get the product's current
+# price; a quantity change keeps the price the line was booked at
+def book_unit_prices(session: Session):
+    items = [
+        item for item in session.new
+        if isinstance(item, models.OrderItem) and item.unit_price is None
+    ] + [
+        item for item in session.dirty
+        if isinstance(item, models.OrderItem)
+        and inspect(item).attrs.product_id.history.has_changes()
+        and not inspect(item).attrs.unit_price.history.has_changes()
+    ]
+    if not items:
+        return
+    prices = product_prices(session, [item.product_id for item in items])
+    for item in items:
+        if item.product_id in prices:
+            item.unit_price = prices[item.product_id]
+
+
+# an order id is replaced by its instance when the session already holds it,
+# so both forms of the same order accumulate into one delta
+def _order_key(session: Session, order):
+    if isinstance(order, models.Order):
+        return order
+    return session.identity_map.get(identity_key(models.Order, order)) or order
+
+
+# new orders enter the client summaries with their final total after the
+# flush, so only the deltas of existing orders are recorded for them here
+def apply_order_total_deltas(session: Session, deltas: dict):
+    deleted_orders = [obj for obj in session.deleted if isinstance(obj, models.Order)]
+    client_deltas = summaries.pending(session)
+    for order, delta in deltas.items():
+        if not delta:
+            continue
+        if isinstance(order, models.Order):
+            if any(order is deleted for deleted in deleted_orders):
+                continue
+            if inspect(order).persistent:
+                # UPDATE orders SET total_order_price = coalesce(total_order_price, 0) + delta
+                order.total_order_price = func.coalesce(models.Order.total_order_price, 0) + delta
+                summaries.add_value(client_deltas, order.client_id, delta)
+            else:
+                order.total_order_price = to_decimal(order.total_order_price) + delta
+        else:
+            client_id = session.execute(
+                update(models.Order)
+                .where(models.Order.id == order)
+                .values(total_order_price=func.coalesce(models.Order.total_order_price, 0) + delta)
+                .returning(models.Order.client_id)
+                .execution_options(synchronize_session=False)
+            ).scalar()
+            summaries.add_value(client_deltas, client_id, delta)
+
+
+@event.listens_for(Session, "before_flush")
+def _maintain_order_totals(session, flush_context, instances):
+    book_unit_prices(session)
+    changes = item_changes(session)
+    if not changes:
+        return
+
+    deltas = defaultdict(Decimal)
+    for order, _, quantity, unit_price in changes:
+        deltas[_order_key(session, order)] += quantity * to_decimal(unit_price)
+    apply_order_total_deltas(session, deltas)
@@ -1,11 +1,27 @@
 from fastapi import FastAPI
-from app.routers import clients, products, orders, users, permissions
+from fastapi.responses import ORJSONResponse
+from app.routers import clients, products, orders, users, permissions, health, metrics
+from app.idempotency import IdempotencyMiddleware
+from app.replicas import ReadYourWritesMiddleware
+from app.sqlstats import SQLStatsMiddleware
+from app.metrics import MetricsMiddleware
 
-app = FastAPI()
+# orjson renders responses several times faster than the stdlib json encoder
+app = FastAPI(default_response_class=ORJSONResponse)
+# Idempotency-Key on POST /orders and POST /clients (retries replay the stored response)
+app.add_middleware(IdempotencyMiddleware)
+# GET handlers read from the replicas (REPLICA_DATABASE_URLS); a client that wrote reads from the primary for a while
+app.add_middleware(ReadYourWritesMiddleware)
+# statements and DB time per request: Server-Timing header, JSON log line, N+1 warnings
+app.add_middleware(SQLStatsMiddleware)
+# outermost: request counters, latency histograms and in-flight gauge for /metrics
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(users.router, prefix="/auth", tags=["auth"])
 app.include_router(permissions.router, prefix="/permissions", tags=["permissions"])
 app.include_router(clients.router, prefix="/clients", tags=["clients"])
 app.include_router(products.router, prefix="/products", tags=["products"])
 app.include_router(orders.router, prefix="/orders", tags=["orders"])
+app.include_router(health.router, prefix="/health", tags=["health"])
+app.include_router(metrics.router, tags=["metrics"])
 # app.include_router(auth.router, prefix="/auth", tags=["auth"])
\ No newline at end of file
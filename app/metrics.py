@@ -0,0 +1,208 @@
+import bisect
+import time
+from collections import defaultdict
+
+from .catalog import catalog_cache
+from .database import pool_status
+from .hashing import password_hasher
+from .idempotency import response_cache
+from .principals import principal_cache
+
+# Prometheus text exposition (format 0.0.4) without a client library: the
+# middleware only does a couple of dict updates per request on the event loop
+# thread, and everything else (pool, caches, hasher) is read from the stats
+# the components already keep, when /metrics is scraped.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# request latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# requests that matched no route share one label, so bad URLs cannot blow up the series count
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)  # last slot: above the largest bucket
+        self.sum = 0.0
+
+
+class HTTPMetrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.requests = defaultdict(int)  # (method, route, status) -> count
+        self.latency = {}  # (method, route) -> _Histogram
+        self.in_flight = 0
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float):
+        self.requests[(method, route, status_code)] += 1
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[(method, route)] = _Histogram(len(self.buckets))
+        histogram.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram.sum += seconds
+
+
+http_metrics = HTTPMetrics()
+
+
+# per-route request counter, latency histogram and in-flight gauge; the route
+# label is the path template ("/orders/{order_id}") that FastAPI puts in the
+# scope when it matches the request
+class MetricsMiddleware:
+    def __init__(self, app, metrics: HTTPMetrics = None):
+        self.app = app
+        self.metrics = metrics or http_metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        metrics = self.metrics
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight -= 1
+            route = scope.get("route")
+            route = getattr(route, "path", None) or UNMATCHED_ROUTE
+            metrics.observe(scope["method"], route, status_code, time.perf_counter() - started)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name: str, kind: str, help_text: str, samples):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+    def histogram(self, name: str, help_text: str, series):
+        # series: [(labels, [(upper bound, cumulative count)...], sum, count)]
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, buckets, total, count in series:
+            for bound, cumulative in buckets:
+                self.lines.append(f"{name}_bucket{_labels({**labels, 'le': _number(bound)})} {cumulative}")
+            self.lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            self.lines.append(f"{name}_count{_labels(labels)} {count}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def _http(writer: _Writer, metrics: HTTPMetrics):
+    writer.metric("http_requests_total", "counter", "HTTP requests by method, route and status.", [
+        ({"method": method, "route": route, "status": status_code}, count)
+        for (method, route, status_code), count in sorted(metrics.requests.items())
+    ])
+    series = []
+    for (method, route), histogram in sorted(metrics.latency.items()):
+        cumulative, buckets = 0, []
+        for bound, count in zip((*metrics.buckets, float("inf")), histogram.counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        series.append(({"method": method, "route": route}, buckets, histogram.sum, cumulative))
+    writer.histogram("http_request_duration_seconds", "HTTP request latency by method and route.", series)
+    writer.metric("http_requests_in_flight", "gauge", "HTTP requests being handled.", [({}, metrics.in_flight)])
+
+
+def _pool(writer: _Writer, pool: dict):
+    if "checkouts" not in pool:
+        return  # not an instrumented pool (in-memory SQLite)
+    for key, name, kind, help_text in (
+        ("size", "db_pool_size", "gauge", "Configured pool size."),
+        ("checked_out", "db_pool_checked_out", "gauge", "Connections in use."),
+        ("checked_in", "db_pool_checked_in", "gauge", "Idle connections in the pool."),
+        ("overflow", "db_pool_overflow", "gauge", "Overflow connections (negative: pool not full yet)."),
+        ("max_overflow", "db_pool_max_overflow", "gauge", "Configured max overflow."),
+        ("checkout_failures", "db_pool_checkout_failures_total", "counter", "Checkouts that failed (timeout, connect error)."),
+    ):
+        writer.metric(name, kind, help_text, [({}, pool[key])])
+    buckets = [(float(bound), count) for bound, count in pool["wait_seconds_histogram"].items()]
+    writer.histogram("db_pool_checkout_wait_seconds", "Time waited for a pool connection.", [
+        ({}, buckets, pool["wait_seconds_sum"], pool["checkouts"]),
+    ])
+
+
+def _caches(writer: _Writer, caches: dict):
+    writer.metric("cache_hits_total", "counter", "Cache hits.", [
+        ({"cache": name}, stats["hits"]) for name, stats in caches.items()
+    ])
+    writer.metric("cache_misses_total", "counter", "Cache misses.", [
+        ({"cache": name}, stats["misses"]) for name, stats in caches.items()
+    ])
+    writer.metric("cache_hit_ratio", "gauge", "Hits / (hits + misses) since start.", [
+        ({"cache": name}, stats["hits"] / (stats["hits"] + stats["misses"]) if stats["hits"] + stats["misses"] else 0.0)
+        for name, stats in caches.items()
+    ])
+    writer.metric("cache_entries", "gauge", "Entries in the cache.", [
+        ({"cache": name}, stats["size"]) for name, stats in caches.items()
+    ])
+    writer.metric("cache_max_entries", "gauge", "Cache capacity.", [
+        ({"cache": name}, stats["max_size"]) for name, stats in caches.items()
+    ])
+
+
+def _hasher(writer: _Writer, hasher: dict):
+    for key, name, kind, help_text in (
+        ("queue_depth", "password_hash_queue_depth", "gauge", "Hash/verify jobs waiting for a worker."),
+        ("running", "password_hash_running", "gauge", "Hash/verify jobs running."),
+        ("workers", "password_hash_workers", "gauge", "Hashing worker threads."),
+        ("max_pending", "password_hash_max_pending", "gauge", "Pending jobs above which requests get 503."),
+        ("completed", "password_hash_completed_total", "counter", "Hash/verify jobs completed."),
+        ("rejected", "password_hash_rejected_total", "counter", "Requests rejected because the queue was full."),
+        ("wait_seconds_sum", "password_hash_wait_seconds_total", "counter", "Time jobs spent queued."),
+        ("run_seconds_sum", "password_hash_run_seconds_total", "counter", "Time spent hashing."),
+    ):
+        writer.metric(name, kind, help_text, [({}, hasher[key])])
+
+
+def render() -> str:
+    writer = _Writer()
+    _http(writer, http_metrics)
+    _pool(writer, pool_status())
+    _caches(writer, {
+        "principal": principal_cache.stats(),
+        "catalog": catalog_cache.stats(),
+        "idempotency": response_cache.stats(),
+    })
+    writer.metric("catalog_not_modified_total", "counter", "Catalog requests answered with 304.", [
+        ({}, catalog_cache.not_modified),
+    ])
+    _hasher(writer, password_hasher.stats())
+    return writer.text()
@@ -1,17 +1,38 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Float, DateTime, Numeric, Boolean, Table
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, ForeignKey, Integer, String, Float, DateTime, Numeric, Boolean, Table, Index, JSON, LargeBinary
+from sqlalchemy.orm import relationship, synonym
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
-from passlib.context import CryptContext
-import bcrypt
 import pydantic
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from .hashing import pwd_context
 
 Base = declarative_base()
 
 
-funcoes_validas = ["admin", "usuario_regular"]
+# each role is one bit of the mask carried by the cached principal,
+# so a role check is a single AND instead of parsing strings
+ROLE_BITS = {"admin": 1 << 0, "usuario_regular": 1 << 1}
+
+funcoes_validas = list(ROLE_BITS)
+
+
+def roles_mask(funcoes) -> int:
+    mask = 0
+    for funcao in funcoes or []:
+        mask |= ROLE_BITS.get(funcao, 0)
+    return mask
+
+
+# uma linha por (usuário, função); o índice (role, user_id) atende "todos os admins"
+class UserRole(Base):
+    __tablename__ = "user_roles"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    role = Column(String, primary_key=True)
+
+    __table_args__ = (
+        Index("ix_user_roles_role_user_id", "role", "user_id"),
+    )
+
 
 class User(Base):
     __tablename__ = "users"
@@ -23,7 +44,27 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     is_admin = Column(Boolean, default=False)
     # funcoes = Column(String, default="{}")
-    funcoes = Column(String)
+    # funcoes = Column(String)
+    roles = relationship(
+        "UserRole", cascade="all, delete-orphan", passive_deletes=True, lazy="selectin", order_by=UserRole.role
+    )
+
+    @property
+    def funcoes(self) -> list:
+        return [user_role.role for user_role in self.roles]
+
+    # aceita lista ou a string antiga separada por vírgula
+    @funcoes.setter
+    def funcoes(self, value):
+        if isinstance(value, str):
+            value = value.split(",")
+        wanted = list(dict.fromkeys(funcao for funcao in value or [] if funcao))
+        current = {user_role.role: user_role for user_role in self.roles}
+        self.roles = [current.get(funcao) or UserRole(role=funcao) for funcao in wanted]
+
+    @property
+    def roles_mask(self) -> int:
+        return roles_mask(self.funcoes)
     
     def verify_password(self, password: str):
         return pwd_context.verify(password, self.hashed_password)
@@ -51,7 +92,7 @@ class User(Base):
             "email": self.email,
             "is_active": self.is_active,
             "is_admin": self.is_admin,
-            "funcoes": self.funcoes.split(",") if self.funcoes else []
+            "funcoes": self.funcoes
         }
 
     @staticmethod
@@ -62,7 +103,7 @@ class User(Base):
             hashed_password=data.get('hashed_password'),
             is_active=data.get('is_active', True),
             is_admin=data.get('is_admin', False),
-            funcoes=",".join(data.get('funcoes', []))
+            funcoes=data.get('funcoes', [])
         )
 
 
@@ -75,6 +116,12 @@ class Client(Base):
     cpf = Column(String, unique=True, index=True)
     orders = relationship("Order", back_populates="client")
 
+    # pg_trgm GIN indexes for substring search (Postgres only, see app/search.py)
+    __table_args__ = (
+        Index("ix_clients_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        Index("ix_clients_email_trgm", "email", postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
 class Order(Base):
     __tablename__ = "orders"
 
@@ -82,13 +129,14 @@ class Order(Base):
     client_id = Column(Integer, ForeignKey("clients.id"))
     status = Column(String)
     total_order_price = Column(Numeric(10, 2), default=0.0)
+    created_at = Column(DateTime, default=datetime.utcnow)
     client = relationship("Client", back_populates="orders")
     items = relationship("OrderItem", back_populates="order")
 
-    # calc total price order
-    def update_total_order_price(self):
-        total = sum(item.total_price for item in self.items)
-        self.total_order_price = total
+    # pedidos de um cliente, já na ordem da paginação por id
+    __table_args__ = (
+        Index("ix_orders_client_id_id", "client_id", "id"),
+    )
 
     def as_dict(self):
         return {
@@ -96,16 +144,30 @@ class Order(Base):
             "client_id": self.client_id,
             "status": self.status,
             "total_order_price": float(self.total_order_price),
+            "created_at": self.created_at,
             "items": [item.as_dict() for item in self.items]
         }
 
+# histórico de pedidos de um cliente, mantido por deltas a cada escrita de
+# pedido (ver app/summaries.py); o ticket médio é lifetime_value / order_count
+class ClientSummary(Base):
+    __tablename__ = "client_summaries"
+
+    client_id = Column(Integer, ForeignKey("clients.id", ondelete="CASCADE"), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    lifetime_value = Column(Numeric(12, 2), nullable=False, default=0)
+    last_order_at = Column(DateTime)
+
 class OrderItem(Base):
     __tablename__ = "order_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"))
-    product_id = Column(Integer, ForeignKey("products.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
     quantity = Column(Integer)
+    # preço de venda do produto quando o item foi gravado; o total do pedido
+    # e as correções dele usam este valor, não o preço atual
+    unit_price = Column(Numeric(10, 2))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     order = relationship("Order", back_populates="items")
@@ -113,7 +175,7 @@ class OrderItem(Base):
 
     @property
     def total_price(self):
-        return self.quantity * self.product.sale_value
+        return self.quantity * self.unit_price
 
     def as_dict(self):
         return {
@@ -131,9 +193,31 @@ class Product(Base):
     id = Column(Integer, primary_key=True, index=True)
     description = Column(String)
     sale_value = Column(Float)
-    barcode = Column(String)
+    barcode = Column(String, unique=True, index=True)
     category = Column(String)
+    # a API chama a coluna category de section
+    section = synonym("category")
     initial_stock = Column(Integer)
     expiry_date = Column(DateTime)
     available = Column(Boolean, default=True)
     order_items = relationship("OrderItem", back_populates="product")
+
+    # listagem ordenada por descrição ou preço (paginação por cursor)
+    __table_args__ = (
+        Index("ix_products_description_id", "description", "id"),
+        Index("ix_products_sale_value_id", "sale_value", "id"),
+    )
+
+
+# respostas guardadas para o header Idempotency-Key (ver app/idempotency.py);
+# status_code NULL = a primeira requisição com a chave ainda está em andamento
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(64), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer)
+    headers = Column(JSON)
+    body = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
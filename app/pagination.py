@@ -0,0 +1,71 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_
+
+MAX_PAGE_SIZE = 100
+
+
+# the cursor is opaque for clients: base64url of the last row's sort key and id
+def encode_cursor(values: dict) -> str:
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if not isinstance(values, dict) or not isinstance(values.get("id"), int):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
+
+
+# keyset pagination: WHERE (sort, id) > (last sort, last id) ORDER BY sort, id LIMIT n + 1
+# (NULL sort values come last, after every non-NULL value)
+async def paginate(db, query, id_column, cursor: str = None, limit: int = 10, sort_column=None):
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    sort_key = sort_column.key if sort_column is not None else None
+    null_tail = None
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if values.get("sort") != sort_key:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor does not match the sort order")
+        last_id = values["id"]
+        if sort_column is None:
+            query = query.where(id_column > last_id)
+        elif values.get("value") is None:
+            query = query.where(and_(sort_column.is_(None), id_column > last_id))
+        else:
+            # sort >= last is a range on the sort column's index (no OR at the
+            # top level, so the page starts with an index seek); the rows with
+            # a NULL sort value are read after the last non-NULL one
+            last_value = values["value"]
+            null_tail = query.where(sort_column.is_(None)).order_by(id_column)
+            query = query.where(and_(
+                sort_column >= last_value,
+                or_(sort_column > last_value, id_column > last_id),
+            ))
+
+    if sort_column is None:
+        query = query.order_by(id_column)
+    else:
+        query = query.order_by(sort_column.asc().nulls_last(), id_column)
+
+    rows = (await db.execute(query.limit(limit + 1))).scalars().all()
+    if null_tail is not None and len(rows) <= limit:
+        rows += (await db.execute(null_tail.limit(limit + 1 - len(rows)))).scalars().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        values = {"sort": sort_key, "id": getattr(last, id_column.key)}
+        if sort_column is not None:
+            values["value"] = getattr(last, sort_key)
+        next_cursor = encode_cursor(values)
+    return rows, next_cursor
@@ -0,0 +1,184 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from . import models
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+# columns that change what a token is allowed to do (hashed_password is not
+# one of them: a rehash on login must not evict the entry); role changes are
+# tracked through user_roles
+PRINCIPAL_FIELDS = ("username", "email", "is_active", "is_admin")
+
+
+# what a protected endpoint gets from get_current_user: a detached, read-only
+# snapshot of the user row, safe to share between requests
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    email: str
+    is_active: bool
+    is_admin: bool
+    funcoes: Tuple[str, ...] = ()
+    roles: int = 0  # models.ROLE_BITS mask
+
+    def has_any_role(self, mask: int) -> bool:
+        return bool(self.roles & mask)
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Principal":
+        funcoes = tuple(user.funcoes)
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            is_active=bool(user.is_active),
+            is_admin=bool(user.is_admin),
+            funcoes=funcoes,
+            roles=models.roles_mask(funcoes),
+        )
+
+
+# TTL + LRU cache of principals keyed by token subject. Entries are evicted
+# when the user row changes or is deleted (see the session events below); the
+# TTL bounds staleness for writes made by other processes.
+class PrincipalCache:
+    def __init__(self, max_size: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # subject -> (expires_at, principal)
+        self._subjects = {}  # user id -> subjects cached for it
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, subject: str) -> Optional[Principal]:
+        entry = self._entries.get(subject)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, principal = entry
+        if expires_at <= time.monotonic():
+            self._drop(subject)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(subject)
+        self.hits += 1
+        return principal
+
+    # generation is read before the database lookup: if a commit invalidated
+    # anything in the meantime the (possibly stale) row is not cached
+    def put(self, subject: str, principal: Principal, generation: int):
+        if not self.enabled or generation != self.generation:
+            return
+        self._drop(subject)
+        self._entries[subject] = (time.monotonic() + self.ttl, principal)
+        self._subjects.setdefault(principal.id, set()).add(subject)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, subject: str):
+        entry = self._entries.pop(subject, None)
+        if entry is None:
+            return
+        user_id = entry[1].id
+        subjects = self._subjects.get(user_id)
+        if subjects is not None:
+            subjects.discard(subject)
+            if not subjects:
+                del self._subjects[user_id]
+
+    def invalidate(self, user_id: int):
+        self.generation += 1
+        for subject in list(self._subjects.get(user_id, ())):
+            self._drop(subject)
+            self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._subjects.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+principal_cache = PrincipalCache()
+
+_INFO_KEY = "principals_invalidated"
+_ALL = "*"
+
+
+def _mark(session: Session, user_id):
+    session.info.setdefault(_INFO_KEY, set()).add(user_id)
+
+
+# changes are only collected during the flush and applied after the commit,
+# so a rolled back transaction leaves the cache alone
+@event.listens_for(models.User, "after_update")
+def _user_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in PRINCIPAL_FIELDS):
+        session = state.session
+        if session is not None:
+            _mark(session, target.id)
+
+
+@event.listens_for(models.User, "after_delete")
+@event.listens_for(models.UserRole, "after_insert")
+@event.listens_for(models.UserRole, "after_delete")
+def _user_or_role_written(mapper, connection, target):
+    session = inspect(target).session
+    if session is not None:
+        _mark(session, target.user_id if isinstance(target, models.UserRole) else target.id)
+
+
+# update(User) / delete(User) statements do not go through the mapper events
+# and may touch any row: drop the whole cache
+@event.listens_for(Session, "do_orm_execute")
+def _user_statement(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in (models.User, models.UserRole):
+            _mark(orm_execute_state.session, _ALL)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(session):
+    user_ids = session.info.pop(_INFO_KEY, None)
+    if not user_ids:
+        return
+    if _ALL in user_ids:
+        principal_cache.clear()
+        return
+    for user_id in user_ids:
+        principal_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session):
+    session.info.pop(_INFO_KEY, None)
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import logging
+from decimal import Decimal
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, summaries
+from .database import SessionLocal, engine
+from .ledger import computed_order_total, to_decimal
+from .replicas import replica_set
+
+logger = logging.getLogger(__name__)
+
+# Numeric(10, 2): differences below one cent are rounding, not drift
+TOLERANCE = Decimal("0.01")
+
+
+# recompute the totals of a batch of orders (keyset on id) and compare with the stored value
+async def reconcile_batch(db: AsyncSession, after_id: int = 0, batch_size: int = 500, fix: bool = False):
+    rows = (await db.execute(
+        select(models.Order.id, models.Order.client_id, models.Order.total_order_price, computed_order_total())
+        .where(models.Order.id > after_id)
+        .order_by(models.Order.id)
+        .limit(batch_size)
+    )).all()
+
+    drift = []
+    for order_id, client_id, stored, computed in rows:
+        stored, computed = to_decimal(stored), to_decimal(computed).quantize(TOLERANCE)
+        if abs(stored - computed) >= TOLERANCE:
+            drift.append({"order_id": order_id, "client_id": client_id, "stored": stored, "computed": computed})
+
+    if fix and drift:
+        # one UPDATE for the batch: the drifted orders take the total of their items
+        await db.execute(
+            update(models.Order)
+            .where(models.Order.id.in_([entry["order_id"] for entry in drift]))
+            .values(total_order_price=computed_order_total())
+            .execution_options(synchronize_session=False)
+        )
+        # the summaries of these clients were built from the drifted totals
+        await db.run_sync(summaries.rebuild_client_summaries, [entry["client_id"] for entry in drift])
+        await db.commit()
+
+    last_id = rows[-1][0] if rows else None
+    return len(rows), drift, last_id
+
+
+async def reconcile_order_totals(db: AsyncSession, after_id: int = 0, batch_size: int = 500, max_batches: int = None, fix: bool = False):
+    report = {"checked": 0, "drifted": 0, "fixed": 0, "last_order_id": after_id, "drift": []}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        checked, drift, last_id = await reconcile_batch(db, after_id=after_id, batch_size=batch_size, fix=fix)
+        if not checked:
+            break
+        batches += 1
+        after_id = last_id
+        report["checked"] += checked
+        report["drifted"] += len(drift)
+        report["fixed"] += len(drift) if fix else 0
+        report["last_order_id"] = last_id
+        report["drift"].extend(drift)
+        for entry in drift:
+            logger.warning(
+                f"Order {entry['order_id']} total drift: stored={entry['stored']} computed={entry['computed']}"
+            )
+    return report
+
+
+# client summaries against the orders they add up (keyset on client id): a
+# summary can drift without any order total drifting, e.g. from deltas
+# applied before the totals were repaired; drifted ones are rebuilt
+async def reconcile_client_summaries(db: AsyncSession, batch_size: int = 500, fix: bool = False):
+    report = {"checked": 0, "drifted": 0, "fixed": 0, "drift": []}
+    after_id = 0
+    while True:
+        client_ids = list((await db.execute(
+            select(models.Client.id).where(models.Client.id > after_id).order_by(models.Client.id).limit(batch_size)
+        )).scalars())
+        if not client_ids:
+            break
+        after_id = client_ids[-1]
+        totals = dict.fromkeys(client_ids, (0, Decimal(0)))
+        for client_id, count, value in (await db.execute(
+            select(models.Order.client_id, func.count(), func.coalesce(func.sum(models.Order.total_order_price), 0))
+            .where(models.Order.client_id.in_(client_ids))
+            .group_by(models.Order.client_id)
+        )).all():
+            totals[client_id] = (count, to_decimal(value))
+        stored = dict.fromkeys(client_ids, (0, Decimal(0)))
+        for client_id, count, value in (await db.execute(
+            select(summaries.summaries.c.client_id, summaries.summaries.c.order_count, summaries.summaries.c.lifetime_value)
+            .where(summaries.summaries.c.client_id.in_(client_ids))
+        )).all():
+            stored[client_id] = (count, to_decimal(value))
+
+        drift = [
+            {"client_id": client_id, "stored": stored[client_id], "computed": totals[client_id]}
+            for client_id in client_ids
+            if stored[client_id][0] != totals[client_id][0]
+            or abs(stored[client_id][1] - totals[client_id][1]) >= TOLERANCE
+        ]
+        if fix and drift:
+            await db.run_sync(summaries.rebuild_client_summaries, [entry["client_id"] for entry in drift])
+            await db.commit()
+        report["checked"] += len(client_ids)
+        report["drifted"] += len(drift)
+        report["fixed"] += len(drift) if fix else 0
+        report["drift"].extend(drift)
+        for entry in drift:
+            logger.warning(
+                f"Client {entry['client_id']} summary drift: stored={entry['stored']} computed={entry['computed']}"
+            )
+    return report
+
+
+async def _run(args):
+    try:
+        async with SessionLocal() as db:
+            report = await reconcile_order_totals(
+                db, after_id=args.after_id, batch_size=args.batch_size, max_batches=args.max_batches, fix=args.fix
+            )
+            # after the totals: a summary is checked against the repaired values
+            report["summaries"] = await reconcile_client_summaries(db, batch_size=args.batch_size, fix=args.fix)
+            return report
+    finally:
+        # aiosqlite's worker threads would keep the interpreter from exiting
+        await engine.dispose()
+        await replica_set.dispose()
+
+
+# python -m app.reconcile --batch-size 500 [--after-id N] [--max-batches N] [--fix]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile orders.total_order_price with the order items, and the client summaries with the orders")
+    parser.add_argument("--after-id", type=int, default=0, help="start after this order id")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--max-batches", type=int, default=None)
+    parser.add_argument("--fix", action="store_true", help="overwrite drifted totals and summaries with the computed values")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(_run(args))
+
+    logger.info(
+        f"Checked {report['checked']} orders up to id {report['last_order_id']}: "
+        f"{report['drifted']} drifted, {report['fixed']} fixed"
+    )
+    client_report = report["summaries"]
+    logger.info(
+        f"Checked {client_report['checked']} client summaries: "
+        f"{client_report['drifted']} drifted, {client_report['fixed']} fixed"
+    )
+    return 1 if (report["drifted"] or client_report["drifted"]) and not args.fix else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,234 @@
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# Read replicas: comma-separated URLs, same format as DATABASE_URL (the sync
+# URLs are accepted too). Empty: every read goes to the primary. Locally two
+# SQLite files work (copy the primary file to make the replica):
+#   DATABASE_URL=sqlite:///./test.db REPLICA_DATABASE_URLS=sqlite:///./replica.db
+REPLICA_DATABASE_URLS = os.getenv("REPLICA_DATABASE_URLS", "")
+# a replica that failed is skipped for this long, then tried again
+REPLICA_RETRY_AFTER = float(os.getenv("REPLICA_RETRY_AFTER", "30"))
+# after a write, the same client reads from the primary for this long (an
+# upper bound of the replication lag), so it sees its own writes
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+STICKY_COOKIE = "db_primary_until"
+
+# errors that mean the replica cannot be reached (not that the query is wrong)
+CONNECTION_ERRORS = (DBAPIError, OSError, TimeoutError)
+
+
+# A session on a replica that moves to the primary when the replica fails a
+# statement (connection dropped, recovery conflict...): the statement is run
+# again there once, and so is everything after it in the request.
+class ReplicaSession(AsyncSession):
+    replica = None  # None once the session is on the primary
+
+    async def _fallback(self, error: DBAPIError):
+        replica, self.replica = self.replica, None
+        # a query that is wrong fails on the primary too; only a replica
+        # that cannot serve is marked down
+        if isinstance(error, OperationalError) or error.connection_invalidated:
+            replica_set.mark_down(replica, error)
+        # close (not rollback): the objects already loaded keep their state
+        await self.close()
+        self.sync_session.bind = database.SessionLocal.kw["bind"].sync_engine
+        replica_set.fallbacks += 1
+
+    async def execute(self, *args, **kwargs):
+        if self.replica is not None:
+            try:
+                return await super().execute(*args, **kwargs)
+            except DBAPIError as e:
+                await self._fallback(e)
+        return await super().execute(*args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        if self.replica is not None:
+            try:
+                return await super().scalar(*args, **kwargs)
+            except DBAPIError as e:
+                await self._fallback(e)
+        return await super().scalar(*args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        if self.replica is not None:
+            try:
+                return await super().get(*args, **kwargs)
+            except DBAPIError as e:
+                await self._fallback(e)
+        return await super().get(*args, **kwargs)
+
+    async def stream(self, *args, **kwargs):
+        if self.replica is not None:
+            try:
+                return await super().stream(*args, **kwargs)
+            except DBAPIError as e:
+                await self._fallback(e)
+        return await super().stream(*args, **kwargs)
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = database.async_url(url)
+        # replicas get a plain queue pool: the pool stats are the primary's
+        self.engine = create_async_engine(self.url, **database._engine_options(self.url, poolclass=AsyncAdaptedQueuePool))
+        self.sessionmaker = async_sessionmaker(self.engine, class_=ReplicaSession, autoflush=False, expire_on_commit=False)
+        self.down_until = 0.0
+        self.reads = 0
+        self.failures = 0
+
+    @property
+    def available(self) -> bool:
+        return self.down_until <= time.monotonic()
+
+
+class ReplicaSet:
+    def __init__(self, urls: str = REPLICA_DATABASE_URLS, retry_after: float = REPLICA_RETRY_AFTER):
+        self.replicas = [Replica(url.strip()) for url in urls.split(",") if url.strip()]
+        self.retry_after = retry_after
+        self._next = itertools.count()
+        self.primary_reads = 0
+        self.sticky_reads = 0
+        self.fallbacks = 0  # reads moved to the primary after a replica error
+
+    # round robin over the replicas that are up; None when none is
+    def pick(self) -> Optional[Replica]:
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next) % len(self.replicas)]
+            if replica.available:
+                return replica
+        return None
+
+    def mark_down(self, replica: Replica, error: Exception):
+        replica.failures += 1
+        replica.down_until = time.monotonic() + self.retry_after
+        logger.warning("replica %s unavailable for %ss: %r", replica.url.render_as_string(), self.retry_after, error)
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [
+                {
+                    "url": replica.url.render_as_string(),
+                    "available": replica.available,
+                    "reads": replica.reads,
+                    "failures": replica.failures,
+                }
+                for replica in self.replicas
+            ],
+            "primary_reads": self.primary_reads,
+            "sticky_reads": self.sticky_reads,
+            "fallbacks": self.fallbacks,
+        }
+
+
+replica_set = ReplicaSet()
+
+# per request: {"pinned": reads go to the primary, "wrote": a commit happened}
+_request_state: ContextVar[Optional[dict]] = ContextVar("replica_request_state", default=None)
+
+
+# the request reads from the primary: it carries the sticky cookie or it wrote
+def pinned_to_primary() -> bool:
+    state = _request_state.get()
+    return state is not None and (state["pinned"] or state["wrote"])
+
+
+# read-only session: a replica when one is up and the client has not written
+# recently, the primary otherwise. A replica that cannot be reached is marked
+# down and the read goes to the primary; a replica that fails a query later
+# on hands the request over to the primary (see ReplicaSession).
+@asynccontextmanager
+async def read_session():
+    replica = None
+    if replica_set.replicas and pinned_to_primary():
+        replica_set.sticky_reads += 1
+    else:
+        replica = replica_set.pick()
+    db = None
+    if replica is not None:
+        db = replica.sessionmaker()
+        try:
+            await db.connection()
+        except CONNECTION_ERRORS as e:
+            await db.close()
+            replica_set.mark_down(replica, e)
+            replica, db = None, None
+    if db is None:
+        db = database.SessionLocal()
+        replica_set.primary_reads += 1
+    else:
+        db.replica = replica
+        replica.reads += 1
+
+    async with db:
+        yield db
+
+
+# dependency for the GET handlers (writes keep using database.get_db)
+async def get_read_db():
+    async with read_session() as db:
+        yield db
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_write(session):
+    state = _request_state.get()
+    if state is not None:
+        state["wrote"] = True
+
+
+def _cookie_pinned(scope) -> bool:
+    try:
+        return float(HTTPConnection(scope).cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+# read-your-writes: a request that commits gets a cookie that sends the
+# client's reads to the primary for REPLICA_STICKY_SECONDS
+class ReadYourWritesMiddleware:
+    def __init__(self, app, sticky_seconds: float = REPLICA_STICKY_SECONDS):
+        self.app = app
+        self.sticky_seconds = sticky_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not replica_set.replicas:
+            return await self.app(scope, receive, send)
+
+        state = {"pinned": _cookie_pinned(scope), "wrote": False}
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and state["wrote"]:
+                until = time.time() + self.sticky_seconds
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{STICKY_COOKIE}={until:.3f}; Max-Age={int(self.sticky_seconds)}; Path=/; HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        token = _request_state.set(state)
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            _request_state.reset(token)
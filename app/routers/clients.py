@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
-from typing import List
-from .. import crud, models, schemas
-from ..database import get_db, SessionLocal
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
+from .. import client_import, crud, exports, models, schemas, search, serializers
+from ..database import get_db
+from ..replicas import get_read_db
+from ..pagination import MAX_PAGE_SIZE
+from ..search import MAX_SEARCH_RESULTS, MIN_QUERY_LENGTH
 from app.security import get_current_user, get_user_com_funcao
 from sqlalchemy.exc import IntegrityError
 
@@ -12,13 +16,6 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # desprotegida
 # @router.get("/", response_model=List[schemas.Client])
 # def read_clients(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
@@ -33,49 +30,37 @@ def get_db():
 # Rota para ler clientes com filtros opcionais
 
 # desprotegida
-@router.get("/", response_model=List[schemas.Client])
-def read_clients(
+@router.get("/", response_model=schemas.Page[schemas.Client])
+async def read_clients(
     name: str = Query(None, description="Filtrar cliente pelo nome"),
     email: str = Query(None, description="Filtrar cliente pelo email"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Cursor da próxima página (next_cursor)"),
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    sort: Optional[Literal["name", "email"]] = Query(None, description="Ordenar por nome ou email"),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    query = db.query(models.Client)
-    
-    if name:
-        query = query.filter(models.Client.name.ilike(f"%{name}%"))
-        
-    if email:
-        query = query.filter(models.Client.email.ilike(f"%{email}%"))
-
-    clients = query.all()
-    
-    return clients
+    clients, next_cursor = await crud.get_clients(db, cursor=cursor, limit=limit, sort=sort, name=name, email=email)
+    return serializers.json_response(serializers.CLIENT_PAGE, {"items": clients, "next_cursor": next_cursor})
 
 # protegida
-@router.get("/", response_model=List[schemas.Client])
-def read_clients(
+@router.get("/", response_model=schemas.Page[schemas.Client])
+async def read_clients(
     name: str = Query(None, description="Filtrar cliente pelo nome"),
     email: str = Query(None, description="Filtrar cliente pelo email"),
-    db: Session = Depends(get_db), current_user: str = Depends(get_current_user)
+    cursor: Optional[str] = Query(None, description="Cursor da próxima página (next_cursor)"),
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    sort: Optional[Literal["name", "email"]] = Query(None, description="Ordenar por nome ou email"),
+    db: AsyncSession = Depends(get_read_db), current_user: str = Depends(get_current_user)
 ):
-    query = db.query(models.Client)
-    
-    if name:
-        query = query.filter(models.Client.name.ilike(f"%{name}%"))
-        
-    if email:
-        query = query.filter(models.Client.email.ilike(f"%{email}%"))
-  
-    clients = query.all()
-    
-    return clients
+    clients, next_cursor = await crud.get_clients(db, cursor=cursor, limit=limit, sort=sort, name=name, email=email)
+    return serializers.json_response(serializers.CLIENT_PAGE, {"items": clients, "next_cursor": next_cursor})
 
 
 
 # desprotegida
 @router.post("/", response_model=schemas.Client)
-def create_client(client: schemas.ClientCreate, db: Session = Depends(get_db)):
-    db_client = crud.create_client(db, client=client)
+async def create_client(client: schemas.ClientCreate, db: AsyncSession = Depends(get_db)):
+    db_client = await crud.create_client(db, client=client)
     return db_client
 
 # # protegida
@@ -108,23 +93,23 @@ def create_client(client: schemas.ClientCreate, db: Session = Depends(get_db)):
 
 
 @router.post("/", response_model=schemas.Client)
-def create_client(client: schemas.ClientCreate, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+async def create_client(client: schemas.ClientCreate, db: AsyncSession = Depends(get_db), current_user: str = Depends(get_current_user)):
     # Verificar se o email já está em uso
-    existing_email = db.query(models.Client).filter(models.Client.email == client.email).first()
+    existing_email = await crud.get_client_by_email(db, client_email=client.email)
     if existing_email:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Email already registered")
 
     # Verificar se o CPF já está em uso
-    existing_cpf = db.query(models.Client).filter(models.Client.cpf == client.cpf).first()
+    existing_cpf = await crud.get_client_by_cpf(db, cpf=client.cpf)
     if existing_cpf:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="CPF already registered")
 
     # Se tudo estiver válido, criar o cliente
     try:
-        db_client = crud.create_client(db, client=client)
+        db_client = await crud.create_client(db, client=client)
         return db_client
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         if "duplicate key value violates unique constraint" in str(e.orig):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="CPF or email already registered")
         else:
@@ -134,54 +119,115 @@ def create_client(client: schemas.ClientCreate, db: Session = Depends(get_db), c
     
     
 
+# importação em massa: corpo CSV (cabeçalho name,email,cpf) ou NDJSON, lido em streaming
+@router.post("/import", response_model=schemas.ClientImportReport)
+async def import_clients(request: Request, db: AsyncSession = Depends(get_db), current_user: str = Depends(get_current_user)):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in client_import.CSV_TYPES:
+        records = client_import.iter_csv(request.stream())
+    elif content_type in client_import.NDJSON_TYPES:
+        records = client_import.iter_ndjson(request.stream())
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Send text/csv or application/x-ndjson"
+        )
+    return await client_import.import_clients(db, records)
+
+# exporta todos os clientes (NDJSON ou CSV) em streaming
+@router.get("/export")
+async def export_clients(format: Literal["ndjson", "csv"] = "ndjson", current_user: str = Depends(get_current_user)):
+    return StreamingResponse(
+        exports.stream_clients(format),
+        media_type=exports.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="clients.{format}"'},
+    )
+
+# desprotegida
+# busca por trecho do nome ou email, ordenada por similaridade (índice de trigramas)
+@router.get("/search", response_model=List[schemas.ClientSearchResult])
+async def search_clients(
+    q: str = Query(..., min_length=MIN_QUERY_LENGTH, description="Trecho do nome ou email"),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS),
+    db: AsyncSession = Depends(get_read_db)
+):
+    results = await search.search_clients(db, q, limit=limit)
+    return [
+        schemas.ClientSearchResult(id=client.id, name=client.name, email=client.email, cpf=client.cpf, score=score)
+        for client, score in results
+    ]
+
+# desprotegida
+# pedidos do cliente, paginados por cursor (índice client_id, id)
+@router.get("/{client_id}/orders", response_model=schemas.Page[schemas.Order])
+async def read_client_orders(
+    client_id: int,
+    cursor: Optional[str] = Query(None, description="Cursor da próxima página (next_cursor)"),
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db)
+):
+    orders, next_cursor = await crud.get_client_orders(db, client_id=client_id, cursor=cursor, limit=limit)
+    # só consulta o cliente quando a página vem vazia
+    if not orders and await crud.get_client(db, client_id=client_id) is None:
+        raise HTTPException(status_code=404, detail="Client not found")
+    return serializers.json_response(serializers.ORDER_PAGE, {"items": orders, "next_cursor": next_cursor})
+
+# desprotegida
+# resumo pré-calculado: quantidade de pedidos, valor total, último pedido e ticket médio
+@router.get("/{client_id}/summary", response_model=schemas.ClientSummary)
+async def read_client_summary(client_id: int, db: AsyncSession = Depends(get_read_db)):
+    summary = await crud.get_client_summary(db, client_id=client_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Client not found")
+    return summary
+
 # desprotegida
 @router.get("/{client_id}", response_model=schemas.Client)
-def read_client(client_id: int, db: Session = Depends(get_db)):
-    db_client = crud.get_client(db, client_id=client_id)
+async def read_client(client_id: int, db: AsyncSession = Depends(get_read_db)):
+    db_client = await crud.get_client(db, client_id=client_id)
     if db_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
     return db_client
 
 # protegida
 @router.get("/{client_id}", response_model=schemas.Client)
-def read_client(client_id: int, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
-    db_client = crud.get_client(db, client_id=client_id)
+async def read_client(client_id: int, db: AsyncSession = Depends(get_read_db), current_user: str = Depends(get_current_user)):
+    db_client = await crud.get_client(db, client_id=client_id)
     if db_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
     return db_client
 
 # desprotegida
 @router.put("/{client_id}", response_model=schemas.Client)
-def update_client(client_id: int, client_update: schemas.ClientUpdate, db: Session = Depends(get_db)):
-    updated_client = crud.update_client(db, client_id, client_update)
+async def update_client(client_id: int, client_update: schemas.ClientUpdate, db: AsyncSession = Depends(get_db)):
+    updated_client = await crud.update_client(db, client_id, client_update)
     if updated_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
     return updated_client
 
 # protegida
 @router.put("/{client_id}", response_model=schemas.Client)
-def update_client(client_id: int, client_update: schemas.ClientUpdate, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
-    updated_client = crud.update_client(db, client_id, client_update)
+async def update_client(client_id: int, client_update: schemas.ClientUpdate, db: AsyncSession = Depends(get_db), current_user: str = Depends(get_current_user)):
+    updated_client = await crud.update_client(db, client_id, client_update)
     if updated_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
     return updated_client
 
 # desprotegida
 @router.delete("/{client_id}", response_model=dict)
-def delete_client(client_id: int, db: Session = Depends(get_db)):
-    db_client = crud.get_client(db, client_id=client_id)
+async def delete_client(client_id: int, db: AsyncSession = Depends(get_db)):
+    db_client = await crud.get_client(db, client_id=client_id)
     if db_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
-    crud.delete_client(db, client_id=client_id)
+    await crud.delete_client(db, client_id=client_id)
     return {"message": f"Client {client_id} deleted successfully"}
 
 # protegida
 @router.delete("/{client_id}", response_model=dict)
-def delete_client(client_id: int, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
-    db_client = crud.get_client(db, client_id=client_id)
+async def delete_client(client_id: int, db: AsyncSession = Depends(get_db), current_user: str = Depends(get_current_user)):
+    db_client = await crud.get_client(db, client_id=client_id)
     if db_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
-    crud.delete_client(db, client_id=client_id)
+    await crud.delete_client(db, client_id=client_id)
     return {"message": f"Client {client_id} deleted successfully"}
 
 
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+
+from ..database import engine, pool_status
+from ..replicas import replica_set
+
+router = APIRouter()
+
+# a starved pool makes the ping wait for a connection; give up before the pool timeout
+DB_HEALTH_TIMEOUT = 5.0
+
+
+async def _ping():
+    async with engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+
+# pool state plus a SELECT 1 round trip: tells pool starvation apart from slow queries
+@router.get("/db")
+async def db_health():
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(_ping(), timeout=DB_HEALTH_TIMEOUT)
+        status, error = "ok", None
+    except Exception as e:
+        status, error = "unavailable", repr(e)
+    body = {
+        "status": status,
+        "ping_ms": round((time.perf_counter() - start) * 1000, 3),
+        "pool": pool_status(),
+    }
+    if replica_set.replicas:
+        body["replicas"] = replica_set.stats()
+    if error:
+        body["error"] = error
+    return JSONResponse(body, status_code=200 if status == "ok" else 503)
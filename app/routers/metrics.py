@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+
+from .. import metrics
+
+router = APIRouter()
+
+
+# Prometheus scrape endpoint (text exposition format)
+@router.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
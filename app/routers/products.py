@@ -1,42 +1,62 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from .. import crud, models, schemas
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
+from .. import crud, models, schemas, serializers
+from ..catalog import cached_response
 from ..database import get_db
+from ..replicas import get_read_db
+from ..pagination import MAX_PAGE_SIZE
 router = APIRouter()
 
-# List all products
-@router.get("/", response_model=List[schemas.Product])
-def read_products(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    products = crud.get_products(db, skip=skip, limit=limit)
-    return products
+# List all products (served from the catalog cache, with ETag / If-None-Match)
+@router.get("/", response_model=schemas.Page[schemas.Product])
+async def read_products(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    sort: Optional[Literal["description", "sale_value"]] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    async def load():
+        products, next_cursor = await crud.get_products(db, cursor=cursor, limit=limit, sort=sort)
+        return {"items": products, "next_cursor": next_cursor}
+
+    return await cached_response(request, ("list", cursor, limit, sort), serializers.PRODUCT_PAGE, load)
 
 # create a product
 @router.post("/", response_model=schemas.Product)   
-def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
-    db_product = crud.create_product(db, product=product)
+async def create_product(product: schemas.ProductCreate, db: AsyncSession = Depends(get_db)):
+    db_product = await crud.create_product(db, product=product)
     return db_product
 
+# catalog sync: insert or update products by barcode
+@router.put("/bulk", response_model=schemas.ProductUpsertReport)
+async def upsert_products(payload: schemas.ProductBulkUpsert, db: AsyncSession = Depends(get_db)):
+    return await crud.upsert_products(db, products=payload.products)
+
 # list one product
 @router.get("/{product_id}", response_model=schemas.Product)
-def read_client(product_id: int, db: Session = Depends(get_db)):
-    db_product = crud.get_product(db, product_id=product_id)
-    if db_product is None:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return db_product
+async def read_client(product_id: int, request: Request, db: AsyncSession = Depends(get_read_db)):
+    async def load():
+        db_product = await crud.get_product(db, product_id=product_id)
+        if db_product is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return db_product
+
+    return await cached_response(request, ("product", product_id), serializers.PRODUCT, load)
 
 # update product
 @router.put("/{product_id}", response_model=schemas.Product)
-def update_product(product_id: int, product_update: schemas.ProductUpdate, db: Session = Depends(get_db)):
-    updated_product = crud.update_product(db, product_id, product_update)
+async def update_product(product_id: int, product_update: schemas.ProductUpdate, db: AsyncSession = Depends(get_db)):
+    updated_product = await crud.update_product(db, product_id, product_update)
     if updated_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
     return updated_product
 
 # delete product
 @router.delete("/{product_id}", response_model=dict)
-def delete_product(product_id: int, db: Session = Depends(get_db)):
-    db_product = crud.delete_product(db, product_id=product_id)
+async def delete_product(product_id: int, db: AsyncSession = Depends(get_db)):
+    db_product = await crud.delete_product(db, product_id=product_id)
     if db_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
     return {"message": f"Product {product_id} deleted successfully"}
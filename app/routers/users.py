@@ -1,28 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, Form, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Form, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import crud, models, schemas
-from app.database import SessionLocal, engine
-from passlib.context import CryptContext
+from app.database import get_db
+from app.replicas import get_read_db
+from app.pagination import MAX_PAGE_SIZE
+from app.hashing import password_hasher
+from app.principals import Principal
 from app.security import criar_token_jwt, get_current_user, get_user_com_funcao, oauth2_scheme
 import bcrypt
 from datetime import datetime, timedelta
-from app.models import User
-from typing import List
+from app.models import User, funcoes_validas
+from typing import List, Optional
 import json
 
 
 
 router = APIRouter()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # lista todos os  usuários
 # @router.get("/users", response_model=list[schemas.User])
 # def list_users(db: Session = Depends(get_db)):
@@ -44,23 +38,29 @@ def get_db():
 #         for user in users
 #     ]
 
-@router.get("/users", response_model=List[schemas.User])
+@router.get("/users", response_model=schemas.Page[schemas.User])
 async def list_users(
-    db: Session = Depends(get_db), 
-    usuario_logado: User = Depends(get_user_com_funcao(funcoes=["admin"]))
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    role: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db), 
+    usuario_logado: Principal = Depends(get_user_com_funcao(funcoes=["admin"]))
 ):
-    users = db.query(models.User).all()
-    return [
+    if role is not None and role not in funcoes_validas:
+        raise HTTPException(status_code=400, detail=f"A função {role} não é uma função válida")
+    users, next_cursor = await crud.get_users(db, cursor=cursor, limit=limit, role=role)
+    items = [
         schemas.User(
             id=user.id,
             username=user.username,
             email=user.email,
             is_active=user.is_active,
             is_admin=user.is_admin,
-            funcoes=user.funcoes.split(',') if isinstance(user.funcoes, str) else user.funcoes or []
+            funcoes=user.funcoes
         )
         for user in users
     ]
+    return {"items": items, "next_cursor": next_cursor}
 
 
 # @router.get("/users", response_model=List[schemas.User])
@@ -81,36 +81,45 @@ async def list_users(
 #     ]
 
 @router.post("/register/")
-def register_user(
+async def register_user(
     username: str = Form(...), 
     email: str = Form(...), 
     password: str = Form(...), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    db_user = crud.get_user_by_username(db, username=username)
+    db_user = await crud.get_user_by_username(db, username=username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    db_email = crud.get_user_by_email(db, email=email)
+    db_email = await crud.get_user_by_email(db, email=email)
     if db_email:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = pwd_context.hash(password)
+    hashed_password = await password_hasher.hash(password)
     
     user = models.User(username=username, email=email, hashed_password=hashed_password)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     return {"message": "User created successfully"}
 
 
 
 @router.post("/login/")
-def login(username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    user = crud.get_user_by_username(db, username=username)
-    if not user or not user.verify_password(password):
+async def login(username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_db)):
+    user = await crud.get_user_by_username(db, username=username)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    valid, new_hash = await password_hasher.verify(password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    # hash com esquema ou custo antigo: regrava com o atual
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     
     # Gerar o token JWT real
     access_token = criar_token_jwt(user.id)
@@ -119,11 +128,11 @@ def login(username: str = Form(...), password: str = Form(...), db: Session = De
 
 
 @router.post("/auth/refresh")
-def refresh_access_token(current_user: models.User = Depends(get_current_user)):
+async def refresh_access_token(current_user: Principal = Depends(get_current_user)):
     # Gerar um novo token JWT com base no ID do usuário
     access_token_expires = timedelta(hours=24)
     expire = datetime.utcnow() + access_token_expires
-    new_token = criar_token_jwt(current_user.username, expire)
+    new_token = criar_token_jwt(current_user.id)
 
     # Retornar o novo token JWT
     return {"access_token": new_token, "token_type": "bearer"}
@@ -132,21 +141,25 @@ def refresh_access_token(current_user: models.User = Depends(get_current_user)):
 
 
 # Exemplo de endpoint protegido
-@router.get("/users", response_model=list[schemas.User])
-def list_users(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    users = crud.get_users(db)
-    return users
+@router.get("/users", response_model=schemas.Page[schemas.User])
+async def list_users(
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db), current_user: Principal = Depends(get_current_user)
+):
+    users, next_cursor = await crud.get_users(db, cursor=cursor, limit=limit)
+    return {"items": users, "next_cursor": next_cursor}
 
 
 
 # remover um user
 @router.delete("/users/{user_id}")
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await crud.get_user(db, user_id=user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
-    db.delete(user)
-    db.commit()
+    await db.delete(user)
+    await db.commit()
     return {"message": "Usuário deletado com sucesso"}
 
 
@@ -1,7 +1,14 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from typing import Generic, List, Optional, TypeVar
 from datetime import datetime
 
+T = TypeVar("T")
+
+# PAGINATION
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+
 # AUTH
 
 class UserBase(BaseModel):
@@ -17,8 +24,7 @@ class User(UserBase):
     is_admin: bool
     funcoes: List[str] = []
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserBase(BaseModel):
     id: int
@@ -34,8 +40,7 @@ class UserFuncoesResponse(BaseModel):
     is_admin: bool
     funcoes: List[str]
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class Token(BaseModel):
     access_token: str
@@ -92,8 +97,28 @@ class Client(ClientBase):
     id: int
     cpf: str
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class ClientSearchResult(Client):
+    score: float
+
+class ClientSummary(BaseModel):
+    client_id: int
+    order_count: int = 0
+    lifetime_value: float = 0.0
+    average_ticket: float = 0.0
+    last_order_at: Optional[datetime] = None
+
+class ClientImportError(BaseModel):
+    line: int
+    reason: str
+
+class ClientImportReport(BaseModel):
+    received: int = 0
+    inserted: int = 0
+    rejected: int = 0
+    errors: List[ClientImportError] = []
+    errors_truncated: bool = False
 
 # PRODUCTS
 class ProductBase(BaseModel):
@@ -117,10 +142,22 @@ class ProductUpdate(BaseModel):
 
 class Product(ProductBase):
     id: int
+    section: Optional[str] = None  # products.category is nullable
     available: Optional[bool] = None 
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+MAX_PRODUCT_UPSERT = 10000
+
+class ProductBulkUpsert(BaseModel):
+    products: List[ProductCreate] = Field(..., min_length=1, max_length=MAX_PRODUCT_UPSERT)
+
+class ProductUpsertReport(BaseModel):
+    received: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    duplicates: int = 0
 
 # ORDER ITEM
 class OrderItemBase(BaseModel):
@@ -144,8 +181,7 @@ class OrderItem(OrderItemBase):
     total_price: float
     
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # ORDERS
 class OrderBase(BaseModel):
@@ -166,6 +202,22 @@ class Order(OrderBase):
     status: str
     items: List[OrderItem] = []
     total_order_price: float = Field(..., alias="total_order_price")
+    created_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+MAX_BULK_ORDERS = 5000
+
+class OrderBulkCreate(BaseModel):
+    orders: List[OrderCreate] = Field(..., min_length=1, max_length=MAX_BULK_ORDERS)
+
+class OrderBulkResult(BaseModel):
+    index: int
+    status: str
+    id: Optional[int] = None
+    detail: Optional[str] = None
 
-    class Config:
-        orm_mode = True
\ No newline at end of file
+class OrderBulkResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[OrderBulkResult]
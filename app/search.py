@@ -0,0 +1,187 @@
+import asyncio
+import heapq
+import os
+import time
+from collections import defaultdict
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+MIN_QUERY_LENGTH = 3
+MAX_SEARCH_RESULTS = 50
+# seconds before the in-process index is rebuilt (0: built once per process)
+CLIENT_INDEX_TTL = float(os.getenv("CLIENT_INDEX_TTL", "60"))
+
+
+def trigrams(text: str) -> set:
+    text = (text or "").lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+# rows and trigram postings of one build of the index
+class _Postings:
+    def __init__(self, fields):
+        self.rows = {}
+        self.postings = {field: defaultdict(set) for field in fields}
+
+    def add(self, client_id: int, name: str, email: str):
+        values = {"name": (name or "").lower(), "email": (email or "").lower()}
+        self.rows[client_id] = values
+        for field, value in values.items():
+            for gram in trigrams(value):
+                self.postings[field][gram].add(client_id)
+
+    def discard(self, client_id: int):
+        values = self.rows.pop(client_id, None)
+        if values is None:
+            return
+        for field, value in values.items():
+            postings = self.postings[field]
+            for gram in trigrams(value):
+                ids = postings.get(gram)
+                if ids is not None:
+                    ids.discard(client_id)
+                    if not ids:
+                        del postings[gram]
+
+    def replace(self, client_id: int, name: str, email: str):
+        self.discard(client_id)
+        self.add(client_id, name, email)
+
+
+# In-process trigram index over clients.name / clients.email, used where the
+# database has no pg_trgm (SQLite). A substring of >= 3 characters can only
+# match rows that contain all of its trigrams, so candidates come from the
+# intersection of the posting sets and only those rows are checked.
+# Writes made by this process are applied as they happen; the TTL bounds how
+# long writes made by other workers stay invisible: an expired index is
+# rebuilt on the next search, into a new copy that replaces the old one when
+# it is complete (searches meanwhile use the old copy).
+class ClientNgramIndex:
+    FIELDS = ("name", "email")
+
+    def __init__(self, ttl: float = CLIENT_INDEX_TTL):
+        self.ttl = ttl
+        self._build_lock = asyncio.Lock()
+        self._built = False
+        self._built_at = 0.0
+        self._building = False
+        self._pending = []
+        self._data = _Postings(self.FIELDS)
+        self.builds = 0
+
+    @property
+    def built(self) -> bool:
+        return self._built
+
+    @property
+    def fresh(self) -> bool:
+        return self._built and (self.ttl <= 0 or time.monotonic() - self._built_at < self.ttl)
+
+    async def build(self, db: AsyncSession, batch_size: int = 10000):
+        if self.fresh:
+            return
+        async with self._build_lock:
+            if self.fresh:
+                return
+            # writes that happen while the table is streamed are replayed afterwards
+            self._building = True
+            try:
+                started = time.monotonic()
+                data = _Postings(self.FIELDS)
+                result = await db.stream(
+                    select(models.Client.id, models.Client.name, models.Client.email)
+                    .execution_options(yield_per=batch_size)
+                )
+                async for client_id, name, email in result:
+                    data.add(client_id, name, email)
+                for change in self._pending:
+                    change(data)
+                self._data = data
+                self._built, self._built_at = True, started
+                self.builds += 1
+            finally:
+                self._building = False
+                self._pending.clear()
+
+    # keep the index in sync with client writes (no-op until the index is built)
+    def upsert(self, client_id: int, name: str, email: str):
+        if self._built:
+            self._data.replace(client_id, name, email)
+        if self._building:
+            self._pending.append(lambda data: data.replace(client_id, name, email))
+
+    def remove(self, client_id: int):
+        if self._built:
+            self._data.discard(client_id)
+        if self._building:
+            self._pending.append(lambda data: data.discard(client_id))
+
+    def clear(self):
+        self._built = False
+        self._data = _Postings(self.FIELDS)
+
+    def _candidates(self, data: _Postings, field: str, grams: set) -> set:
+        postings = data.postings[field]
+        sets = sorted((postings.get(gram, set()) for gram in grams), key=len)
+        if not sets or not sets[0]:
+            return set()
+        return set.intersection(*sets)
+
+    # [(client_id, score)] of the rows containing q, best similarity first
+    def search(self, q: str, limit: int = 20):
+        q = q.lower()
+        grams = trigrams(q)
+        data = self._data
+        scored = []
+        for field in self.FIELDS:
+            for client_id in self._candidates(data, field, grams):
+                if q in data.rows[client_id][field]:
+                    scored.append((client_id, similarity(grams, trigrams(data.rows[client_id][field]))))
+        best = {}
+        for client_id, score in scored:
+            best[client_id] = max(score, best.get(client_id, 0.0))
+        return heapq.nlargest(limit, best.items(), key=lambda entry: (entry[1], -entry[0]))
+
+
+client_index = ClientNgramIndex()
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+# substring search on name/email ranked by trigram similarity:
+# pg_trgm GIN indexes on Postgres, the in-process index elsewhere
+async def search_clients(db: AsyncSession, q: str, limit: int = 20):
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+
+    if db.get_bind().dialect.name == "postgresql":
+        pattern = f"%{_escape_like(q)}%"
+        score = func.greatest(func.similarity(models.Client.name, q), func.similarity(models.Client.email, q))
+        rows = (await db.execute(
+            select(models.Client, score.label("score"))
+            .where(or_(
+                models.Client.name.ilike(pattern, escape="\\"),
+                models.Client.email.ilike(pattern, escape="\\"),
+            ))
+            .order_by(score.desc(), models.Client.id)
+            .limit(limit)
+        )).all()
+        return [(client, float(score)) for client, score in rows]
+
+    await client_index.build(db)
+    matches = client_index.search(q, limit=limit)
+    if not matches:
+        return []
+    result = await db.execute(select(models.Client).where(models.Client.id.in_([client_id for client_id, _ in matches])))
+    clients = {client.id: client for client in result.scalars()}
+    return [(clients[client_id], score) for client_id, score in matches if client_id in clients]
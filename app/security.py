@@ -1,27 +1,29 @@
 from datetime import datetime, timedelta
 import os
 from typing import Any, Union
-from passlib.context import CryptContext
 from jose import jwt, JWTError
 from dotenv import load_dotenv
 
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .database import SessionLocal
+from .database import get_db
 from . import models
 from .schemas import TokenData
-from fastapi.security import HTTPBearer
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from typing import List
 
 from .models import User
+from .principals import Principal, principal_cache
 import logging
 
 oauth2_scheme = HTTPBearer()
 
 load_dotenv()
 
-pwd_context = CryptContext(schemes=["sha256_crypt"], deprecated="auto")
+# bcrypt context shared with models and the hashing worker pool
+from .hashing import pwd_context
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'sadasddsadsasad')
 JWT_ALGORITHM = os.getenv('ALGORITHM', 'HS512')
@@ -62,34 +64,46 @@ def decode_token(token: str) -> dict:
 #     return user
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# sub is the user id (login) or, for older tokens, the username
+def _user_by_subject(subject: str):
+    if subject.isdigit():
+        return select(models.User).where(models.User.id == int(subject))
+    return select(models.User).where(models.User.username == subject)
 
-        
-def get_current_user(db: Session = Depends(SessionLocal), token: str = Depends(oauth2_scheme)):
-    payload = decode_token(token)
-    if payload is None:
+
+# the principal is served from principal_cache when possible, so most
+# protected requests do not touch the users table
+async def get_current_user(db: AsyncSession = Depends(get_db), token: HTTPAuthorizationCredentials = Depends(oauth2_scheme)) -> Principal:
+    payload = decode_token(token.credentials)
+    if payload is None or payload.get("sub") is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    username: str = payload.get("sub")
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+    subject = str(payload["sub"])
+
+    principal = principal_cache.get(subject)
+    if principal is None:
+        generation = principal_cache.generation
+        user = (await db.execute(_user_by_subject(subject))).scalars().first()
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        principal = Principal.from_user(user)
+        principal_cache.put(subject, principal, generation)
+
+    if not principal.is_active:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Inactive user")
+    return principal
 
 
 
 def get_user_com_funcao(funcoes: List[str] = []):
-    def inner(usuario_logado: User = Depends(get_current_user)) -> User:
+    # máscara calculada uma vez, na declaração da rota
+    required = models.roles_mask(funcoes)
+
+    async def inner(usuario_logado: Principal = Depends(get_current_user)) -> Principal:
         if not len(funcoes):
             return usuario_logado
         
-        for funcao in funcoes:
-            if funcao in usuario_logado.funcoes.split(','):
-                return usuario_logado
+        if usuario_logado.has_any_role(required):
+            return usuario_logado
 
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="O usuário não possui permissão para realizar essa ação!"
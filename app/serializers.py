@@ -0,0 +1,29 @@
+from typing import List
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+from . import schemas
+
+# Response fast path for the hot list/detail endpoints. Returning a Response
+# skips FastAPI's own validation + python-mode serialization + render; the
+# adapters below are built once at import and do both steps in pydantic-core
+# (validate ORM objects with from_attributes, dump straight to JSON bytes).
+# The routes keep their response_model so the OpenAPI schema is unchanged.
+
+ORDER = TypeAdapter(schemas.Order)
+ORDER_LIST = TypeAdapter(List[schemas.Order])
+ORDER_PAGE = TypeAdapter(schemas.Page[schemas.Order])
+CLIENT_PAGE = TypeAdapter(schemas.Page[schemas.Client])
+PRODUCT = TypeAdapter(schemas.Product)
+PRODUCT_PAGE = TypeAdapter(schemas.Page[schemas.Product])
+
+
+def dump_json(adapter: TypeAdapter, data) -> bytes:
+    return adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+
+
+def json_response(adapter: TypeAdapter, data, status_code: int = 200, headers: dict = None) -> Response:
+    return Response(
+        content=dump_json(adapter, data), status_code=status_code, headers=headers, media_type="application/json"
+    )
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SQL_STATS_ENABLED = os.getenv("SQL_STATS_ENABLED", "true").lower() in ("1", "true", "yes")
+# slowest statements kept per request (for the log line)
+SQL_SLOWEST_STATEMENTS = int(os.getenv("SQL_SLOWEST_STATEMENTS", "3"))
+# the same SELECT shape this many times in one request is flagged as a likely N+1
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "10"))
+# test mode: raise NPlusOneDetected instead of only logging it
+SQL_N_PLUS_ONE_RAISE = os.getenv("SQL_N_PLUS_ONE_RAISE", "false").lower() in ("1", "true", "yes")
+
+_SPACES = re.compile(r"\s+")
+_NUMBERED_PARAMS = re.compile(r"\$\d+")  # asyncpg: $1, $2...
+_PARAM_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")  # expanded IN lists
+
+
+class NPlusOneDetected(RuntimeError):
+    pass
+
+
+def statement_shape(statement: str) -> str:
+    shape = _SPACES.sub(" ", statement).strip()
+    shape = _NUMBERED_PARAMS.sub("?", shape)
+    return _PARAM_LISTS.sub("(?)", shape)
+
+
+# statements issued while handling one request; filled by the engine events
+# below through a context variable (it follows the request into the greenlet
+# the async session runs the driver in)
+class RequestStats:
+    def __init__(self, label: str = "", threshold: int = SQL_N_PLUS_ONE_THRESHOLD, raise_on_n_plus_one: bool = SQL_N_PLUS_ONE_RAISE):
+        self.label = label
+        self.threshold = threshold
+        self.raise_on_n_plus_one = raise_on_n_plus_one
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.slowest = []  # [(seconds, statement)], longest first
+        self.shapes = Counter()  # SELECT shape -> times issued
+
+    def record(self, statement: str, seconds: float):
+        self.statements += 1
+        self.db_seconds += seconds
+        if SQL_SLOWEST_STATEMENTS > 0 and (len(self.slowest) < SQL_SLOWEST_STATEMENTS or seconds > self.slowest[-1][0]):
+            self.slowest.append((seconds, statement))
+            self.slowest.sort(key=lambda entry: entry[0], reverse=True)
+            del self.slowest[SQL_SLOWEST_STATEMENTS:]
+
+        # only reads: a batched write runs the same INSERT once per page and is not an N+1
+        shape = statement_shape(statement)
+        if shape[:6].upper() != "SELECT":
+            return
+        self.shapes[shape] += 1
+        if self.raise_on_n_plus_one and self.threshold > 0 and self.shapes[shape] == self.threshold:
+            raise NPlusOneDetected(f"{self.label}: {self.threshold} executions of the same statement: {shape[:300]}")
+
+    def repeated(self) -> list:
+        if self.threshold <= 0:
+            return []
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= self.threshold]
+
+    def server_timing(self) -> str:
+        total_ms = (time.perf_counter() - self.started) * 1000
+        return f'db;dur={self.db_seconds * 1000:.3f};desc="{self.statements} statements", total;dur={total_ms:.3f}'
+
+    def as_dict(self) -> dict:
+        return {
+            "request": self.label,
+            "statements": self.statements,
+            "db_ms": round(self.db_seconds * 1000, 3),
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "slowest": [{"ms": round(seconds * 1000, 3), "statement": statement[:500]} for seconds, statement in self.slowest],
+            "n_plus_one": [{"count": count, "statement": shape[:500]} for shape, count in self.repeated()],
+        }
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("sql_request_stats", default=None)
+
+
+def current() -> Optional[RequestStats]:
+    return _current.get()
+
+
+# all engines (primary and replicas)
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._sqlstats_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = getattr(context, "_sqlstats_started", None)
+    if stats is not None and started is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+# statement count and DB time per request: a Server-Timing header on the
+# response and one JSON log line per request that touched the database;
+# repeated SELECT shapes (likely N+1) are logged as a warning
+class SQLStatsMiddleware:
+    def __init__(self, app, enabled: bool = SQL_STATS_ENABLED):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(f'{scope["method"]} {scope["path"]}')
+        status_code = None
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"server-timing", stats.server_timing().encode("latin-1"))]
+            await send(message)
+
+        token = _current.set(stats)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if stats.statements:
+                record = {**stats.as_dict(), "status": status_code}
+                if record["n_plus_one"]:
+                    logger.warning("likely N+1 %s", json.dumps(record))
+                else:
+                    logger.info("sql %s", json.dumps(record))
@@ -0,0 +1,160 @@
+from collections import defaultdict
+
+from fastapi import HTTPException, status
+from sqlalchemy import case, event, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import ledger, models
+from .catalog import catalog_cache
+
+# products.initial_stock is the stock still available for sale: order items
+# reserve it when they are written and give it back when they are removed.
+#
+# A reservation is a conditional update
+#   UPDATE products SET initial_stock = initial_stock - q, available = initial_stock - q > 0
+#   WHERE id = :id AND initial_stock >= q
+# so the check and the decrement happen atomically under the row lock, with
+# no read-modify-write window. All the products of a change set go in one
+# statement (q given per id by a CASE); when there is more than one they are
+# first locked with SELECT ... FOR UPDATE ORDER BY id, so two orders on the
+# same SKUs queue instead of deadlocking. Either way it is a constant number
+# of round trips however many lines an order has.
+
+
+class InsufficientStock(HTTPException):
+    def __init__(self, product_id: int):
+        super().__init__(status_code=status.HTTP_409_CONFLICT, detail=f"Insufficient stock for product {product_id}")
+        self.product_id = product_id
+
+
+def _by_product(deltas: dict, sign: int = 1):
+    return case({product_id: sign * delta for product_id, delta in deltas.items()}, value=models.Product.id)
+
+
+# adds deltas[id] to each product's stock, unless a decrement would make it
+# negative; returns the ids that were updated
+def _change_stock(session: Session, deltas: dict, sign: int = 1) -> set:
+    delta = _by_product(deltas, sign)
+    new_stock = models.Product.initial_stock + delta
+    stmt = (
+        update(models.Product)
+        .where(models.Product.id.in_(deltas.keys()), or_(delta >= 0, new_stock >= 0))
+        .values(initial_stock=new_stock, available=new_stock > 0)
+        .returning(models.Product.id)
+        .execution_options(synchronize_session=False)
+    )
+    return set(session.execute(stmt).scalars())
+
+
+# deltas: {product_id: quantity}, positive reserves stock, negative releases it.
+# Either every delta is applied or none is: on a shortage the ones already
+# applied are reverted (same transaction) and InsufficientStock is raised.
+def apply_stock_deltas(session: Session, deltas: dict):
+    changes = {product_id: -quantity for product_id, quantity in deltas.items() if quantity}
+    if not changes:
+        return
+    with session.no_autoflush:
+        if len(changes) > 1:
+            _lock_products(session, changes.keys())
+        applied = _change_stock(session, changes)
+        if len(applied) != len(changes):
+            if applied:
+                _change_stock(session, {product_id: changes[product_id] for product_id in applied}, sign=-1)
+            raise InsufficientStock(min(set(changes) - applied))
+    session.info["catalog_changed"] = True
+
+
+def _lock_products(session: Session, product_ids):
+    # a fixed lock order, so two writers on the same SKUs queue instead of deadlocking
+    session.execute(
+        select(models.Product.id)
+        .where(models.Product.id.in_(product_ids))
+        .order_by(models.Product.id)
+        .with_for_update()
+    )
+
+
+# Reserves the stock of a batch of orders (a list of {product_id: quantity})
+# with a constant number of statements. The quantities are added up and
+# reserved with one conditional CASE update; when every product has enough,
+# that is all. Otherwise the products that came up short are read (locked)
+# and their stock goes to the orders in input order. An order that does not
+# fit is rejected and its share of the products that were reserved is given
+# back; the give-backs and the short products' reservations go in one more
+# CASE update. Returns, per order, None or the InsufficientStock error.
+def reserve_orders(session: Session, orders: list) -> list:
+    totals = defaultdict(int)
+    for quantities in orders:
+        for product_id, quantity in quantities.items():
+            totals[product_id] += quantity
+    changes = {product_id: -quantity for product_id, quantity in totals.items() if quantity}
+    results = [None] * len(orders)
+    if not changes:
+        return results
+
+    with session.no_autoflush:
+        if len(changes) > 1:
+            _lock_products(session, changes.keys())
+        applied = _change_stock(session, changes)
+        session.info["catalog_changed"] = True
+        short = set(changes) - applied
+        if not short:
+            return results
+
+        available = dict(session.execute(
+            select(models.Product.id, models.Product.initial_stock)
+            .where(models.Product.id.in_(short))
+            .with_for_update()
+        ).all())
+        adjustments = defaultdict(int)
+        for index, quantities in enumerate(orders):
+            missing = sorted(
+                product_id for product_id in short
+                if quantities.get(product_id, 0) > (available.get(product_id) or 0)
+            )
+            if missing:
+                results[index] = InsufficientStock(missing[0])
+                for product_id, quantity in quantities.items():
+                    if product_id in applied:
+                        adjustments[product_id] += quantity  # give back
+                continue
+            for product_id in short:
+                quantity = quantities.get(product_id, 0)
+                if quantity:
+                    available[product_id] -= quantity
+                    adjustments[product_id] -= quantity  # reserve
+        adjustments = {product_id: delta for product_id, delta in adjustments.items() if delta}
+        if adjustments:
+            # the rows are locked (or, on SQLite, the write lock is held), so
+            # the reservations computed above cannot come up short here
+            _change_stock(session, adjustments)
+    return results
+
+
+def order_quantities(order) -> dict:
+    quantities = defaultdict(int)
+    for item in order.items:
+        quantities[item.product_id] += item.quantity
+    return quantities
+
+
+# item writes made through the ORM (order updates, order item routes, order
+# deletes) reserve or release the difference, using the ledger's change set
+@event.listens_for(Session, "before_flush")
+def _maintain_stock(session, flush_context, instances):
+    deltas = defaultdict(int)
+    for _, product_id, quantity, _ in ledger.item_changes(session):
+        deltas[product_id] += quantity
+    apply_stock_deltas(session, deltas)
+
+
+# stock and availability are part of the cached catalog responses
+@event.listens_for(Session, "after_commit")
+def _refresh_catalog(session):
+    if session.info.pop("catalog_changed", False):
+        catalog_cache.bump()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_catalog_change(session):
+    session.info.pop("catalog_changed", None)
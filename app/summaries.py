@@ -0,0 +1,168 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import case, delete, event, func, insert, inspect, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import ledger, models
+
+# client_summaries keeps, per client, the order count, the sum of the order
+# totals and the date of the last order, so the summary endpoint is a single
+# primary-key read. It is maintained by deltas on every order write: the
+# flush hook below covers the ORM paths (orders deleted or moved to another
+# client, item writes through the ledger) and the Core bulk paths in crud
+# call apply_client_deltas themselves, like they do for stock.
+
+PENDING = "client_summary_deltas"
+
+summaries = models.ClientSummary.__table__
+
+
+@dataclass
+class ClientDelta:
+    orders: int = 0
+    value: Decimal = Decimal(0)
+    last_order_at: Optional[datetime] = None
+    removed: bool = False  # an order left the client: last_order_at is recomputed
+
+
+def client_deltas() -> defaultdict:
+    return defaultdict(ClientDelta)
+
+
+def add_order(deltas: dict, client_id, total, created_at: Optional[datetime]):
+    delta = deltas[client_id]
+    delta.orders += 1
+    delta.value += ledger.to_decimal(total)
+    if created_at is not None and (delta.last_order_at is None or created_at > delta.last_order_at):
+        delta.last_order_at = created_at
+
+
+def remove_order(deltas: dict, client_id, total):
+    delta = deltas[client_id]
+    delta.orders -= 1
+    delta.value -= ledger.to_decimal(total)
+    delta.removed = True
+
+
+def add_value(deltas: dict, client_id, value):
+    deltas[client_id].value += ledger.to_decimal(value)
+
+
+# value deltas recorded by the ledger during before_flush, applied after the flush
+def pending(session: Session) -> defaultdict:
+    return session.info.setdefault(PENDING, client_deltas())
+
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def apply_client_deltas(session: Session, deltas: dict, deleted_clients=()):
+    rows, removed = [], []
+    for client_id, delta in deltas.items():
+        if client_id is None or client_id in deleted_clients:
+            continue
+        if delta.orders or delta.value or delta.last_order_at is not None:
+            rows.append({
+                "client_id": client_id,
+                "order_count": delta.orders,
+                "lifetime_value": delta.value,
+                "last_order_at": delta.last_order_at,
+            })
+        if delta.removed:
+            removed.append(client_id)
+
+    if rows:
+        # one INSERT ... ON CONFLICT (client_id) DO UPDATE for all the clients;
+        # the first order of a client creates its row
+        stmt = _INSERTS[session.get_bind().dialect.name](summaries)
+        stmt = stmt.on_conflict_do_update(index_elements=[summaries.c.client_id], set_={
+            "order_count": summaries.c.order_count + stmt.excluded.order_count,
+            "lifetime_value": summaries.c.lifetime_value + stmt.excluded.lifetime_value,
+            "last_order_at": case(
+                (or_(summaries.c.last_order_at.is_(None), stmt.excluded.last_order_at > summaries.c.last_order_at),
+                 stmt.excluded.last_order_at),
+                else_=summaries.c.last_order_at,
+            ),
+        })
+        session.execute(stmt, rows)
+    if removed:
+        # the last order date cannot be decremented: read it back from ix_orders_client_id_id
+        session.execute(
+            update(summaries).where(summaries.c.client_id.in_(removed)).values(last_order_at=_last_order_at())
+        )
+    if deleted_clients:
+        session.execute(delete(summaries).where(summaries.c.client_id.in_(deleted_clients)))
+
+
+def _last_order_at():
+    return (
+        select(func.max(models.Order.created_at))
+        .where(models.Order.client_id == summaries.c.client_id)
+        .scalar_subquery()
+    )
+
+
+# recompute the summaries (all of them, or the given clients') from the
+# orders table: seeding, and orders whose stored total was repaired
+def rebuild_client_summaries(connection, client_ids=None):
+    totals = (
+        select(
+            models.Order.client_id,
+            func.count(),
+            func.coalesce(func.sum(models.Order.total_order_price), 0),
+            func.max(models.Order.created_at),
+        )
+        .join(models.Client, models.Client.id == models.Order.client_id)
+        .group_by(models.Order.client_id)
+    )
+    stale = delete(summaries)
+    if client_ids is not None:
+        totals = totals.where(models.Order.client_id.in_(set(client_ids)))
+        stale = stale.where(summaries.c.client_id.in_(set(client_ids)))
+    connection.execute(stale)
+    connection.execute(insert(summaries).from_select(
+        ["client_id", "order_count", "lifetime_value", "last_order_at"], totals
+    ))
+
+
+# after_flush still sees the pre-flush new/dirty/deleted sets and attribute
+# history, and the rows are already written (the new orders have their final
+# total, the deleted ones are gone for the last_order_at subquery)
+@event.listens_for(Session, "after_flush")
+def _maintain_client_summaries(session, flush_context):
+    deltas = session.info.pop(PENDING, None) or client_deltas()
+    deleted_clients = set()
+
+    for obj in session.new:
+        if isinstance(obj, models.Order):
+            add_order(deltas, obj.client_id, obj.total_order_price, obj.created_at)
+    for obj in session.deleted:
+        if isinstance(obj, models.Order):
+            state = inspect(obj)
+            remove_order(deltas, ledger.committed(state, "client_id"), ledger.committed(state, "total_order_price"))
+        elif isinstance(obj, models.Client):
+            deleted_clients.add(obj.id)
+    for obj in session.dirty:
+        if not isinstance(obj, models.Order):
+            continue
+        state = inspect(obj)
+        history = state.attrs.client_id.history
+        if history.has_changes():
+            # the order moves with its old total; item changes in the same
+            # flush were already recorded by the ledger on the new client
+            total = ledger.committed(state, "total_order_price")
+            remove_order(deltas, ledger.committed(state, "client_id"), total)
+            add_order(deltas, history.added[0] if history.added else None, total, obj.created_at)
+
+    if deltas or deleted_clients:
+        apply_client_deltas(session, deltas, deleted_clients)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop(PENDING, None)
@@ -0,0 +1,456 @@
+# In-process load test: seeds a scratch database and drives every router of
+# app/main.py through httpx.ASGITransport (no server, no network).
+#
+#   python -m benchmarks.load [--database-url sqlite+aiosqlite:///./load.db]
+#       [--users 100] [--clients 1000] [--products 500] [--orders 2000] [--items 3]
+#       [--requests 200] [--concurrency 20] [--only orders] [--output run.json]
+#       [--compare baseline.json --max-regression 0.25]
+#
+# THE DATABASE IS DROPPED AND RECREATED: point it at a scratch SQLite file or
+# a local Postgres database made for this.
+#
+# All the endpoints run at the same time, each with --requests requests,
+# interleaved with --concurrency requests in flight in total, so reads and
+# writes of different routers contend for the pool and the locks like they do
+# in production. The SQL statements are counted per request (a context
+# variable set around each one), so they still belong to their endpoint.
+# Per endpoint it reports throughput,
+# p50/p95/p99/max latency, statements per request and the status codes.
+# --output writes the results as JSON (with the commit and the volumes);
+# --compare checks them against an earlier file and exits with status 1 when
+# an endpoint got slower than --max-regression (p95) or issues more statements
+# per request.
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+PASSWORD = "bench-password"
+ADMIN = "bench_admin"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="In-process load test of the API")
+    parser.add_argument("--database-url", default="sqlite+aiosqlite:///./load.db")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=3, help="items per seeded order")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at once (all endpoints)")
+    parser.add_argument("--only", action="append", default=[], help="run only endpoints containing this text (repeatable)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed p95 increase (0.25 = 25%%)")
+    return parser.parse_args(argv)
+
+
+@dataclass
+class Context:
+    rng: random.Random
+    run_id: str
+    users: list = field(default_factory=list)
+    disposable: list = field(default_factory=list)  # seeded users only DELETE /auth/users/{id} touches
+    clients: list = field(default_factory=list)
+    products: list = field(default_factory=list)
+    orders: list = field(default_factory=list)
+    headers: dict = field(default_factory=dict)  # Authorization of the admin
+    created: dict = field(default_factory=lambda: {"clients": [], "products": [], "orders": []})
+    locks: dict = field(default_factory=dict)
+
+    def pick(self, kind: str) -> int:
+        return self.rng.choice(getattr(self, kind))
+
+    # seeded users other than the admin (users[0])
+    def regular_user(self, i: int) -> int:
+        regular = self.users[1:] or self.users
+        return regular[i % len(regular)]
+
+    def lock(self, key: str) -> asyncio.Lock:
+        return self.locks.setdefault(key, asyncio.Lock())
+
+    def order_items(self, count: int) -> list:
+        return [{"product_id": product_id, "quantity": self.rng.randint(1, 5)}
+                for product_id in self.rng.sample(self.products, min(count, len(self.products)))]
+
+
+# build(ctx, i) returns the httpx.request keyword arguments of request i;
+# collect(ctx, response) keeps ids of what was created, for the deletes;
+# restore(ctx, request) returns the request that undoes a successful one (sent
+# right after it, not measured) for scenarios that would otherwise run out of
+# state to change
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    build: Callable
+    ok: tuple = (200,)
+    max_requests: Optional[int] = None
+    collect: Optional[Callable] = None
+    restore: Optional[Callable] = None
+
+
+def _keep(kind: str, key: str = "id"):
+    def collect(ctx, response):
+        ctx.created[kind].append(response.json()[key])
+    return collect
+
+
+def _created(ctx, kind: str):
+    created = ctx.created[kind]
+    return created.pop() if created else 10 ** 9  # nothing left: a 404 is counted
+
+
+SCENARIOS = [
+    # auth / users
+    Scenario("POST /auth/login/", "POST", lambda ctx, i: {
+        "url": "/auth/login/", "data": {"username": ADMIN, "password": PASSWORD}}, max_requests=50),
+    Scenario("POST /auth/auth/refresh", "POST", lambda ctx, i: {"url": "/auth/auth/refresh", "headers": ctx.headers}),
+    Scenario("GET /auth/users", "GET", lambda ctx, i: {
+        "url": "/auth/users", "params": {"limit": 50}, "headers": ctx.headers}),
+    Scenario("POST /auth/register/", "POST", lambda ctx, i: {
+        "url": "/auth/register/",
+        "data": {"username": f"reg_{ctx.run_id}_{i}", "email": f"reg_{ctx.run_id}_{i}@bench.example.com", "password": PASSWORD},
+    }, max_requests=50),
+    # permissions
+    # seeded users have usuario_regular and not admin: each scenario changes
+    # one of the two roles and puts it back, so any number of requests cycles
+    # over the users
+    Scenario("DELETE /permissions/{id}/funcoes/{funcao}", "DELETE", lambda ctx, i: {
+        "url": f"/permissions/{ctx.regular_user(i)}/funcoes/usuario_regular"},
+        restore=lambda ctx, request: {"method": "POST", "url": request["url"]}),
+    Scenario("POST /permissions/{id}/funcoes/{funcao}", "POST", lambda ctx, i: {
+        "url": f"/permissions/{ctx.regular_user(i)}/funcoes/admin"},
+        restore=lambda ctx, request: {"method": "DELETE", "url": request["url"]}),
+    # clients
+    Scenario("GET /clients/", "GET", lambda ctx, i: {"url": "/clients/", "params": {"limit": 50}}),
+    Scenario("GET /clients/{id}", "GET", lambda ctx, i: {"url": f"/clients/{ctx.pick('clients')}"}),
+    Scenario("GET /clients/{id}/orders", "GET", lambda ctx, i: {"url": f"/clients/{ctx.pick('clients')}/orders"}),
+    Scenario("GET /clients/{id}/summary", "GET", lambda ctx, i: {"url": f"/clients/{ctx.pick('clients')}/summary"}),
+    Scenario("GET /clients/search", "GET", lambda ctx, i: {
+        "url": "/clients/search", "params": {"q": f"client {ctx.rng.randrange(len(ctx.clients)):05d}"}}),
+    Scenario("POST /clients/", "POST", lambda ctx, i: {
+        "url": "/clients/",
+        "json": {"name": f"new client {i}", "email": f"new_{ctx.run_id}_{i}@bench.example.com", "cpf": f"9{ctx.run_id}{i:07d}"},
+    }, collect=_keep("clients")),
+    Scenario("PUT /clients/{id}", "PUT", lambda ctx, i: {
+        "url": f"/clients/{ctx.pick('clients')}", "json": {"name": f"client renamed {i}"}}),
+    Scenario("GET /clients/export", "GET", lambda ctx, i: {
+        "url": "/clients/export", "params": {"format": "csv"}, "headers": ctx.headers}, max_requests=5),
+    Scenario("DELETE /clients/{id}", "DELETE", lambda ctx, i: {
+        "url": f"/clients/{_created(ctx, 'clients')}"}, ok=(200, 404)),
+    # products
+    Scenario("GET /products/", "GET", lambda ctx, i: {"url": "/products/", "params": {"limit": 50}}),
+    Scenario("GET /products/{id}", "GET", lambda ctx, i: {"url": f"/products/{ctx.pick('products')}"}),
+    Scenario("POST /products/", "POST", lambda ctx, i: {
+        "url": "/products/",
+        "json": {"description": f"new product {i}", "sale_value": 9.9, "barcode": f"NEW-{ctx.run_id}-{i}",
+                 "section": "bench", "initial_stock": 1000},
+    }, collect=_keep("products")),
+    Scenario("PUT /products/{id}", "PUT", lambda ctx, i: {
+        "url": f"/products/{ctx.pick('products')}", "json": {"description": f"product renamed {i}"}}),
+    Scenario("PUT /products/bulk", "PUT", lambda ctx, i: {
+        "url": "/products/bulk",
+        "json": {"products": [
+            {"description": f"bulk product {n}", "sale_value": 1.0 + i % 7, "barcode": f"BULK-{ctx.run_id}-{n}",
+             "section": "bench", "initial_stock": 1000}
+            for n in range(100)
+        ]},
+    }, max_requests=20),
+    Scenario("DELETE /products/{id}", "DELETE", lambda ctx, i: {
+        "url": f"/products/{_created(ctx, 'products')}"}, ok=(200, 404)),
+    # orders
+    Scenario("GET /orders/", "GET", lambda ctx, i: {"url": "/orders/", "params": {"limit": 50}}),
+    Scenario("GET /orders/{id}", "GET", lambda ctx, i: {"url": f"/orders/{ctx.pick('orders')}"}),
+    Scenario("POST /orders/", "POST", lambda ctx, i: {
+        "url": "/orders/", "json": {"client_id": ctx.pick("clients"), "status": "new", "items": ctx.order_items(3)},
+    }, collect=_keep("orders")),
+    Scenario("PUT /orders/{id}", "PUT", lambda ctx, i: {
+        "url": f"/orders/{ctx.pick('orders')}", "json": {"status": f"updated {i}", "items": ctx.order_items(3)}}),
+    Scenario("POST /orders/bulk", "POST", lambda ctx, i: {
+        "url": "/orders/bulk",
+        "json": {"orders": [
+            {"client_id": ctx.pick("clients"), "status": "bulk", "items": ctx.order_items(3)} for _ in range(50)
+        ]},
+    }, max_requests=20),
+    Scenario("GET /orders/export", "GET", lambda ctx, i: {"url": "/orders/export"}, max_requests=5),
+    Scenario("DELETE /orders/{id}", "DELETE", lambda ctx, i: {
+        "url": f"/orders/{_created(ctx, 'orders')}"}, ok=(200, 404)),
+    # health
+    Scenario("GET /health/db", "GET", lambda ctx, i: {"url": "/health/db"}),
+    # users seeded for it, not the ones the permissions scenarios use
+    Scenario("DELETE /auth/users/{id}", "DELETE", lambda ctx, i: {
+        "url": f"/auth/users/{ctx.disposable[i] if i < len(ctx.disposable) else 10 ** 9}"}, ok=(200, 404)),
+]
+
+
+async def _insert(conn, table, rows, batch_size=1000):
+    from sqlalchemy import insert
+
+    for start in range(0, len(rows), batch_size):
+        await conn.execute(insert(table), rows[start:start + batch_size])
+
+
+async def _ids(conn, table) -> list:
+    from sqlalchemy import select
+
+    return list((await conn.execute(select(table.c.id).order_by(table.c.id))).scalars())
+
+
+# volumes come from args (users, clients, products, orders, items);
+# disposable_users extra users go to ctx.disposable for DELETE /auth/users/{id}
+async def seed(engine, args, ctx: Context, disposable_users: int = 0):
+    from app import models, summaries
+    from app.hashing import pwd_context
+
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+
+        hashed = pwd_context.hash(PASSWORD)  # once: bcrypt per user would dominate the seeding
+        users = max(args.users, 1)
+        await _insert(conn, models.User.__table__, [
+            {"username": ADMIN if n == 0 else f"bench_user_{n}", "email": f"user{n}@bench.example.com",
+             "hashed_password": hashed, "is_active": True, "is_admin": n == 0}
+            for n in range(users + disposable_users)
+        ])
+        ids = await _ids(conn, models.User.__table__)
+        ctx.users, ctx.disposable = ids[:users], ids[users:]
+        await _insert(conn, models.UserRole.__table__, [
+            {"user_id": user_id, "role": "admin" if n == 0 else "usuario_regular"} for n, user_id in enumerate(ids)
+        ])
+
+        await _insert(conn, models.Client.__table__, [
+            {"name": f"client {n:05d}", "email": f"client{n}@bench.example.com", "cpf": f"{n:011d}"}
+            for n in range(max(args.clients, 1))
+        ])
+        ctx.clients = await _ids(conn, models.Client.__table__)
+
+        products = [
+            {"description": f"product {n}", "sale_value": round(ctx.rng.uniform(1, 100), 2), "barcode": f"SEED-{n}",
+             "category": f"section {n % 20}", "initial_stock": 10 ** 9, "available": True}
+            for n in range(max(args.products, 1))
+        ]
+        await _insert(conn, models.Product.__table__, products)
+        ctx.products = await _ids(conn, models.Product.__table__)
+        prices = {product_id: product["sale_value"] for product_id, product in zip(ctx.products, products)}
+
+        orders, lines = [], []
+        for n in range(max(args.orders, 1)):
+            items = ctx.order_items(args.items)
+            orders.append({
+                "client_id": ctx.pick("clients"), "status": "seeded",
+                "total_order_price": round(sum(prices[item["product_id"]] * item["quantity"] for item in items), 2),
+            })
+            lines.append(items)
+        await _insert(conn, models.Order.__table__, orders)
+        ctx.orders = await _ids(conn, models.Order.__table__)
+        now = datetime.utcnow()
+        await _insert(conn, models.OrderItem.__table__, [
+            {"order_id": order_id, "created_at": now, "updated_at": now, "unit_price": prices[item["product_id"]], **item}
+            for order_id, items in zip(ctx.orders, lines) for item in items
+        ])
+        await conn.run_sync(summaries.rebuild_client_summaries)
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+# statement counter of the request being sent; every request runs in its own
+# task (asyncio.gather) and the ASGI app in that task, so the engine event
+# below sees the counter of the request that issued the statement
+_statements: ContextVar[Optional[list]] = ContextVar("load_statements", default=None)
+
+
+def count_statement(*_):
+    counter = _statements.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+# requests and results of one scenario; the requests of all the scenarios
+# are interleaved and share the --concurrency slots
+class ScenarioRun:
+    def __init__(self, scenario: Scenario, count: int):
+        self.scenario = scenario
+        self.count = count
+        self.latencies, self.statuses, self.unexpected = [], Counter(), []
+        self.statements = [0]
+        self.started = self.finished = None
+
+    async def send(self, http, ctx: Context, request: dict):
+        scenario = self.scenario
+        token = _statements.set(self.statements)
+        try:
+            started = time.perf_counter()
+            response = await http.request(scenario.method, **request)
+            self.latencies.append(time.perf_counter() - started)
+        finally:
+            _statements.reset(token)
+        self.statuses[response.status_code] += 1
+        if response.status_code not in scenario.ok:
+            self.unexpected.append(response.text[:200])
+            return
+        if scenario.collect and response.status_code == 200:
+            scenario.collect(ctx, response)
+        if scenario.restore:
+            restored = await http.request(**scenario.restore(ctx, request))
+            if restored.status_code != 200:
+                self.unexpected.append(f"restore: {restored.text[:200]}")
+
+    async def one(self, http, ctx: Context, semaphore: asyncio.Semaphore, i: int):
+        async with semaphore:
+            if self.started is None:
+                self.started = time.perf_counter()
+            request = self.scenario.build(ctx, i)
+            if self.scenario.restore is None:
+                await self.send(http, ctx, request)
+            else:
+                # the next request on the same url has to find the state restored
+                async with ctx.lock(request["url"]):
+                    await self.send(http, ctx, request)
+            self.finished = time.perf_counter()
+
+    def result(self) -> dict:
+        count, latencies = self.count, sorted(self.latencies)
+        return {
+            "requests": count,
+            "errors": len(self.unexpected),
+            "statuses": {str(code): n for code, n in sorted(self.statuses.items())},
+            "throughput_rps": round(count / (self.finished - self.started), 2),
+            "mean_ms": round(sum(latencies) / count * 1000, 3),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "max_ms": round(latencies[-1] * 1000, 3),
+            "statements_per_request": round(self.statements[0] / count, 2),
+            "first_error": self.unexpected[0] if self.unexpected else None,
+        }
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+    for name, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if previous is None:
+            continue
+        if previous["p95_ms"] > 0 and current["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if current["statements_per_request"] > previous["statements_per_request"]:
+            regressions.append(
+                f"{name}: statements/request {previous['statements_per_request']} -> {current['statements_per_request']}"
+            )
+    return regressions
+
+
+def print_table(results: dict):
+    print(f"{'endpoint':<42} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'stmts':>6}  statuses")
+    for name, r in results["endpoints"].items():
+        statuses = " ".join(f"{code}x{n}" for code, n in r["statuses"].items())
+        print(f"{name:<42} {r['throughput_rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+              f"{r['p99_ms']:>8.1f} {r['statements_per_request']:>6.1f}  {statuses}")
+
+
+async def run(args) -> dict:
+    import httpx
+    from sqlalchemy import event
+
+    from app.database import engine
+    from app.main import app
+
+    ctx = Context(rng=random.Random(args.seed), run_id=str(int(time.time()) % 100000))
+    started = time.perf_counter()
+    await seed(engine, args, ctx, disposable_users=args.requests)
+    seeded_in = time.perf_counter() - started
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_statement)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as http:
+        response = await http.post("/auth/login/", data={"username": ADMIN, "password": PASSWORD})
+        response.raise_for_status()
+        ctx.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        runs = [
+            ScenarioRun(scenario, min(args.requests, scenario.max_requests or args.requests)) for scenario in SCENARIOS
+            if not args.only or any(text in scenario.name for text in args.only)
+        ]
+        # round robin over the scenarios: request i of every endpoint, then i + 1...
+        semaphore = asyncio.Semaphore(args.concurrency)
+        await asyncio.gather(*(
+            run.one(http, ctx, semaphore, i)
+            for i in range(max((run.count for run in runs), default=0)) for run in runs if i < run.count
+        ))
+        endpoints = {run.scenario.name: run.result() for run in runs}
+    await engine.dispose()
+
+    return {
+        "meta": {
+            "commit": _commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "database": engine.url.get_backend_name(),
+            "python": platform.python_version(),
+            "volumes": {name: getattr(args, name) for name in ("users", "clients", "products", "orders", "items")},
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "seeded_in_seconds": round(seeded_in, 2),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.disable(logging.INFO)  # the routers log every request at INFO
+    os.environ["DATABASE_URL"] = args.database_url  # read when app.database is imported
+    results = asyncio.run(run(args))
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+
+    failed = [name for name, r in results["endpoints"].items() if r["errors"]]
+    for name in failed:
+        print(f"ERRORS: {name}: {results['endpoints'][name]['errors']} unexpected responses, "
+              f"first: {results['endpoints'][name]['first_error']}")
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
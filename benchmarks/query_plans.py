@@ -0,0 +1,247 @@
+# Query-plan check for app/crud.py: every public crud function is called
+# against a seeded scratch database, the statements it issues are captured on
+# the engine and each SELECT / UPDATE / DELETE is EXPLAINed with the same
+# parameters. Exits with status 1 when
+#   * a statement that filters or joins (has a WHERE) scans a large table
+#     (a Seq Scan on Postgres, with enable_seqscan off so only a missing index
+#     can produce one; a SCAN or an AUTOMATIC index on SQLite), or
+#   * a public crud function has no call below (add one, or list it in
+#     SKIPPED with the reason), so new queries cannot skip the check.
+# Statements without a WHERE (first pages, unfiltered lists) read a bounded
+# prefix in index order and are not flagged.
+#
+#   python -m benchmarks.query_plans [--database-url sqlite+aiosqlite:///./plans.db]
+#       [--clients 5000] [--products 2000] [--orders 5000] [--large-table-rows 1000] [--verbose]
+#
+# THE DATABASE IS DROPPED AND RECREATED (same seeding as benchmarks.load).
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+# crud functions that are not called, and why
+SKIPPED = {
+    "create_permission": "models.Permission does not exist",
+    "get_permission_by_id": "models.Permission does not exist",
+    "get_permissions": "models.Permission does not exist",
+    "get_permission_by_name": "models.Permission does not exist",
+    "get_permissions_by_role_id": "models.Role does not exist",
+}
+
+# (call, dialect) -> tables the call may scan, and why
+EXEMPT_SCANS = {
+    ("get_clients(name=)", "sqlite"): ({"clients"}, "substring match: pg_trgm GIN index on Postgres only"),
+    ("get_clients(email=)", "sqlite"): ({"clients"}, "substring match: pg_trgm GIN index on Postgres only"),
+}
+
+_SQLITE_PLAN = re.compile(r"^(SCAN|SEARCH) (\w+)(?: AS (\w+))?")
+_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+_EXPLAINED = ("SELECT", "UPDATE", "DELETE")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN every query issued by app/crud.py")
+    parser.add_argument("--database-url", default="sqlite+aiosqlite:///./plans.db")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--items", type=int, default=3)
+    parser.add_argument("--large-table-rows", type=int, default=1000, help="tables with at least this many rows are large")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    return parser.parse_args(argv)
+
+
+def calls(ctx):
+    from app import crud, schemas
+
+    client_id, product_id, order_id = ctx.clients[0], ctx.products[0], ctx.orders[0]
+    new_client = schemas.ClientCreate(name="plan client", email="plan@example.com", cpf="plan-cpf")
+    new_product = schemas.ProductCreate(description="plan product", sale_value=1.0, barcode="PLAN-1", section="s", initial_stock=100)
+    new_order = schemas.OrderCreate(client_id=client_id, status="plan", items=[
+        schemas.OrderItemCreate(product_id=product, quantity=1) for product in ctx.products[:3]
+    ])
+    created = {}
+
+    async def second_page(fn, db, **kwargs):
+        _, cursor = await fn(db, limit=5, **kwargs)
+        return await fn(db, cursor=cursor, limit=5, **kwargs)
+
+    async def keep(kind, coro):
+        created[kind] = await coro
+        return created[kind]
+
+    # (call name, crud function, coroutine factory)
+    return [
+        ("get_user", crud.get_user, lambda db: crud.get_user(db, ctx.users[0])),
+        ("get_user_by_username", crud.get_user_by_username, lambda db: crud.get_user_by_username(db, "bench_admin")),
+        ("get_user_by_email", crud.get_user_by_email, lambda db: crud.get_user_by_email(db, "user1@bench.example.com")),
+        ("get_users", crud.get_users, lambda db: second_page(crud.get_users, db)),
+        ("get_users(role=)", crud.get_users, lambda db: second_page(crud.get_users, db, role="admin")),
+        ("create_user", crud.create_user, lambda db: crud.create_user(db, "plan_user", "plan_user@example.com", "x")),
+        ("get_clients", crud.get_clients, lambda db: second_page(crud.get_clients, db)),
+        ("get_clients(sort=name)", crud.get_clients, lambda db: second_page(crud.get_clients, db, sort="name")),
+        ("get_clients(sort=email)", crud.get_clients, lambda db: second_page(crud.get_clients, db, sort="email")),
+        ("get_clients(name=)", crud.get_clients, lambda db: second_page(crud.get_clients, db, name="client 0001")),
+        ("get_clients(email=)", crud.get_clients, lambda db: second_page(crud.get_clients, db, email="client1")),
+        ("create_client", crud.create_client, lambda db: keep("client", crud.create_client(db, new_client))),
+        ("get_client", crud.get_client, lambda db: crud.get_client(db, client_id)),
+        ("get_client_by_name", crud.get_client_by_name, lambda db: crud.get_client_by_name(db, "client 00001")),
+        ("get_client_by_email", crud.get_client_by_email, lambda db: crud.get_client_by_email(db, "client1@bench.example.com")),
+        ("get_client_by_cpf", crud.get_client_by_cpf, lambda db: crud.get_client_by_cpf(db, "00000000001")),
+        ("find_existing_clients", crud.find_existing_clients, lambda db: crud.find_existing_clients(
+            db, emails=["client1@bench.example.com"], cpfs=["00000000002"])),
+        ("update_client", crud.update_client, lambda db: crud.update_client(db, client_id, schemas.ClientUpdate(name="renamed"))),
+        ("delete_client", crud.delete_client, lambda db: crud.delete_client(db, created["client"].id)),
+        ("get_products", crud.get_products, lambda db: second_page(crud.get_products, db)),
+        ("get_products(sort=description)", crud.get_products, lambda db: second_page(crud.get_products, db, sort="description")),
+        ("get_products(sort=sale_value)", crud.get_products, lambda db: second_page(crud.get_products, db, sort="sale_value")),
+        ("create_product", crud.create_product, lambda db: keep("product", crud.create_product(db, new_product))),
+        ("get_product", crud.get_product, lambda db: crud.get_product(db, product_id)),
+        ("update_product", crud.update_product, lambda db: crud.update_product(
+            db, product_id, schemas.ProductUpdate(description="renamed", initial_stock=10 ** 9))),
+        ("delete_product", crud.delete_product, lambda db: crud.delete_product(db, created["product"].id)),
+        ("upsert_products", crud.upsert_products, lambda db: crud.upsert_products(db, [
+            new_product.model_copy(update={"barcode": barcode}) for barcode in ("SEED-1", "PLAN-2")
+        ])),
+        ("get_orders", crud.get_orders, lambda db: second_page(crud.get_orders, db)),
+        ("get_order", crud.get_order, lambda db: crud.get_order(db, order_id)),
+        ("get_client_orders", crud.get_client_orders, lambda db: second_page(crud.get_client_orders, db, client_id=client_id)),
+        ("get_client_summary", crud.get_client_summary, lambda db: crud.get_client_summary(db, client_id)),
+        ("create_order", crud.create_order, lambda db: keep("order", crud.create_order(db, new_order))),
+        ("create_orders_bulk", crud.create_orders_bulk, lambda db: crud.create_orders_bulk(db, [new_order, new_order])),
+        ("update_order", crud.update_order, lambda db: crud.update_order(db, created["order"].id, schemas.OrderUpdate(
+            status="changed", items=[{"product_id": ctx.products[0], "quantity": 2}, {"product_id": ctx.products[5], "quantity": 1}],
+        ))),
+        ("create_order_item", crud.create_order_item, lambda db: keep("item", crud.create_order_item(
+            db, created["order"].id, schemas.OrderItemCreate(product_id=ctx.products[7], quantity=1)))),
+        ("get_order_item", crud.get_order_item, lambda db: crud.get_order_item(db, created["item"].id)),
+        ("get_order_item_by_product_id", crud.get_order_item_by_product_id, lambda db: crud.get_order_item_by_product_id(db, product_id)),
+        ("update_order_item", crud.update_order_item, lambda db: crud.update_order_item(
+            db, created["item"].id, schemas.OrderItemUpdate(product_id=ctx.products[7], quantity=3))),
+        ("delete_order_item", crud.delete_order_item, lambda db: crud.delete_order_item(db, created["item"].id)),
+        ("delete_order", crud.delete_order, lambda db: crud.delete_order(db, created["order"].id)),
+    ]
+
+
+def uncovered(called) -> list:
+    from app import crud
+
+    public = {
+        name for name, fn in inspect.getmembers(crud, inspect.iscoroutinefunction)
+        if not name.startswith("_") and fn.__module__ == crud.__name__
+    }
+    return sorted(public - {fn.__name__ for fn in called} - set(SKIPPED))
+
+
+def _pg_scans(plan) -> list:
+    scans, nodes = [], [plan[0]["Plan"] if isinstance(plan, list) else plan["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if node.get("Node Type") == "Seq Scan":
+            scans.append((node["Relation Name"], "Seq Scan"))
+        nodes.extend(node.get("Plans", []))
+    return scans
+
+
+async def explain(conn, dialect: str, statement: str, parameters):
+    if dialect == "postgresql":
+        result = await conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        plan = result.scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return json.dumps(plan[0]["Plan"], indent=1), _pg_scans(plan)
+
+    rows = (await conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)).all()
+    scans = []
+    for row in rows:
+        detail = row[-1]
+        match = _SQLITE_PLAN.match(detail)
+        if match and (match.group(1) == "SCAN" or "AUTOMATIC" in detail):
+            scans.append((match.group(2), detail))
+    return "\n".join(row[-1] for row in rows), scans
+
+
+async def run(args) -> int:
+    from sqlalchemy import event, func, select
+
+    from app import models
+    from app.database import SessionLocal, engine
+    from benchmarks.load import Context, seed
+
+    import random
+
+    ctx = Context(rng=random.Random(args.seed), run_id="plans")
+    await seed(engine, args, ctx)
+    dialect = engine.dialect.name
+
+    captured, current = {}, [None]  # statement -> (call, parameters)
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].upper() not in _EXPLAINED or statement in captured:
+            return
+        if executemany:
+            parameters = parameters[0]
+        captured[statement] = (current[0], parameters)
+
+    driver = calls(ctx)
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    for name, _, call in driver:
+        current[0] = name
+        async with SessionLocal() as db:
+            await call(db)
+    event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+    async with engine.connect() as conn:
+        sizes = {}
+        for table in models.Base.metadata.sorted_tables:
+            sizes[table.name] = (await conn.execute(select(func.count()).select_from(table))).scalar()
+        large = {name for name, rows in sizes.items() if rows >= args.large_table_rows}
+
+        if dialect == "postgresql":
+            await conn.exec_driver_sql("SET enable_seqscan = off")
+        violations = []
+        for statement, (name, parameters) in captured.items():
+            plan, scans = await explain(conn, dialect, statement, parameters)
+            exempt_tables, _ = EXEMPT_SCANS.get((name, dialect), (set(), None))
+            bad = [
+                (table, detail) for table, detail in scans
+                if table in large and table not in exempt_tables and (_WHERE.search(statement) or "AUTOMATIC" in detail)
+            ]
+            if bad:
+                violations.append((name, statement, plan, bad))
+            if args.verbose:
+                print(f"-- {name}\n{' '.join(statement.split())}\n{plan}\n")
+    await engine.dispose()
+
+    missing = uncovered(fn for _, fn, _ in driver)
+    print(f"{dialect}: {len(captured)} statements from {len(driver)} crud calls, "
+          f"large tables: {', '.join(sorted(large)) or '-'}")
+    for (name, dialect_name), (tables, reason) in EXEMPT_SCANS.items():
+        if dialect_name == dialect:
+            print(f"exempt: {name} may scan {', '.join(sorted(tables))} ({reason})")
+    for name, statement, plan, bad in violations:
+        print(f"\nFAIL {name}: full scan of {', '.join(sorted({table for table, _ in bad}))}")
+        print(f"  {' '.join(statement.split())[:400]}")
+        print("  " + plan.replace("\n", "\n  "))
+    for name in missing:
+        print(f"FAIL crud.{name} is not covered: add a call to calls() or list it in SKIPPED")
+    if not violations and not missing:
+        print("OK: no full scans of large tables")
+    return 1 if violations or missing else 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.disable(logging.WARNING)  # crud logs every read at INFO, bulk failures at ERROR
+    os.environ["DATABASE_URL"] = args.database_url  # read when app.database is imported
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
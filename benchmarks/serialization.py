@@ -0,0 +1,93 @@
+# Microbenchmark: serializing a list of 1,000 orders (3 items each).
+#
+#   python -m benchmarks.serialization [--orders 1000] [--items 3] [--repeat 20]
+#
+# Compares FastAPI's response path for `response_model=List[schemas.Order]`
+# (validate + python-mode serialize, then render) with JSONResponse and
+# ORJSONResponse, against the precompiled TypeAdapter path in
+# app/serializers.py. Needs no database: the ORM objects are built in memory.
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app import models, schemas, serializers
+
+
+def build_orders(count: int, items: int) -> list:
+    now = datetime(2024, 6, 17, 10, 13, 3)
+    products = [models.Product(id=i, description=f"Produto {i}", sale_value=1.5 + i) for i in range(1, 51)]
+    orders = []
+    for order_id in range(1, count + 1):
+        order = models.Order(id=order_id, client_id=order_id % 97 + 1, status="pending")
+        total = Decimal(0)
+        for position in range(items):
+            product = products[(order_id + position) % len(products)]
+            item = models.OrderItem(
+                id=order_id * items + position,
+                order_id=order_id,
+                product_id=product.id,
+                quantity=position + 1,
+                unit_price=Decimal(str(product.sale_value)),
+                created_at=now,
+                updated_at=now,
+            )
+            item.product = product
+            order.items.append(item)
+            total += Decimal(str(item.total_price))
+        order.total_order_price = total
+        orders.append(order)
+    return orders
+
+
+def fastapi_path(field, response_class, orders) -> bytes:
+    content = asyncio.run(serialize_response(field=field, response_content=orders))
+    return response_class(content).body
+
+
+def timed(fn, repeat: int) -> float:
+    fn()  # warm up
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Order list serialization microbenchmark")
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    orders = build_orders(args.orders, args.items)
+    field = create_response_field(name="response", type_=List[schemas.Order])
+
+    # the paths must produce the same document
+    expected = json.loads(fastapi_path(field, JSONResponse, orders))
+    assert json.loads(serializers.dump_json(serializers.ORDER_LIST, orders)) == expected
+
+    cases = {
+        "fastapi + JSONResponse": lambda: fastapi_path(field, JSONResponse, orders),
+        "fastapi + ORJSONResponse": lambda: fastapi_path(field, ORJSONResponse, orders),
+        "TypeAdapter.dump_json": lambda: serializers.dump_json(serializers.ORDER_LIST, orders),
+    }
+    baseline = None
+    print(f"{args.orders} orders x {args.items} items, best of {args.repeat}")
+    for name, fn in cases.items():
+        seconds = timed(fn, args.repeat)
+        baseline = baseline or seconds
+        print(f"{name:<26} {seconds * 1000:8.2f} ms  {1 / seconds:8.1f} lists/s  x{baseline / seconds:.2f}")
+
+
+if __name__ == "__main__":
+    main()
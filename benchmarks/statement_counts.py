@@ -0,0 +1,103 @@
+# Statement-count regression check for the order reads.
+#
+#   python -m benchmarks.statement_counts [--database-url sqlite+aiosqlite:///./statement_counts.db]
+#       [--orders 300] [--items 5]
+#
+# THE DATABASE IS DROPPED AND RECREATED (same seeding as benchmarks/load.py).
+#
+# GET /orders/ and GET /orders/{id} load the items and their products in
+# selectin batches, so they issue a fixed number of statements whatever the
+# page size or the number of items. This requests pages of several sizes
+# (first page and a cursor page) and single orders, reads the statement count
+# from the Server-Timing header added by app/sqlstats.py and exits with
+# status 1 when a read does not issue exactly the pinned number.
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import sys
+
+# orders, items (selectin), products (selectin)
+EXPECTED = {
+    "GET /orders/": 3,
+    "GET /orders/{id}": 3,
+}
+
+PAGE_SIZES = (1, 10, 100)
+
+_STATEMENTS = re.compile(r'desc="(\d+) statements"')
+
+
+# every volume benchmarks.load.seed() reads has to be here
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pin the statement count of the order reads")
+    parser.add_argument("--database-url", default="sqlite+aiosqlite:///./statement_counts.db")
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--orders", type=int, default=300)
+    parser.add_argument("--items", type=int, default=5, help="items per seeded order")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def statements(response) -> int:
+    match = _STATEMENTS.search(response.headers.get("server-timing", ""))
+    if match is None:
+        raise SystemExit("no statement count in Server-Timing: is SQL_STATS_ENABLED off?")
+    return int(match.group(1))
+
+
+async def run(args) -> list:
+    import httpx
+
+    from app.database import engine
+    from app.main import app
+    from benchmarks.load import Context, seed
+
+    ctx = Context(rng=random.Random(args.seed), run_id="counts")
+    checks = []  # (endpoint, request, statements)
+    try:
+        await seed(engine, args, ctx)
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://counts") as http:
+            for limit in PAGE_SIZES:
+                response = await http.get("/orders/", params={"limit": limit})
+                response.raise_for_status()
+                checks.append(("GET /orders/", f"limit={limit}", statements(response)))
+                cursor = response.json()["next_cursor"]
+                if cursor:
+                    response = await http.get("/orders/", params={"limit": limit, "cursor": cursor})
+                    response.raise_for_status()
+                    checks.append(("GET /orders/", f"limit={limit} cursor", statements(response)))
+
+            for order_id in (ctx.orders[0], ctx.orders[len(ctx.orders) // 2], ctx.orders[-1]):
+                response = await http.get(f"/orders/{order_id}")
+                response.raise_for_status()
+                checks.append(("GET /orders/{id}", f"id={order_id}", statements(response)))
+    finally:
+        # aiosqlite's worker thread would keep the process from exiting on an error
+        await engine.dispose()
+    return checks
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.disable(logging.INFO)  # the routers log every request at INFO
+    os.environ["DATABASE_URL"] = args.database_url  # read when app.database is imported
+    os.environ["SQL_STATS_ENABLED"] = "true"
+    checks = asyncio.run(run(args))
+
+    failed = 0
+    for endpoint, request, count in checks:
+        ok = count == EXPECTED[endpoint]
+        failed += not ok
+        print(f"{'OK' if ok else 'FAIL':<5} {endpoint:<18} {request:<18} {count} statements (expected {EXPECTED[endpoint]})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# Concurrency stress test for the stock reservation (app/stock.py).
+#
+#   python -m benchmarks.stock_stress --database-url postgresql+asyncpg://... [--orders 500] [--stock 100]
+#
+# Fires --orders concurrent POST /orders/ for the same hot SKU, starting with
+# --stock units, through the real app and connection pool, then checks:
+#   * exactly min(orders, stock // quantity) orders were accepted, the rest got 409
+#   * products.initial_stock == stock - accepted * quantity (never negative)
+#   * the order items of the SKU add up to what was reserved
+#   * products.available matches the remaining stock
+# Exits with status 1 when any check fails. Without --database-url a SQLite
+# file is used (writers are serialized there, so it checks correctness, not
+# row-lock contention).
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stock reservation stress test")
+    parser.add_argument("--database-url", default="sqlite+aiosqlite:///./stock_stress.db")
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=200, help="requests in flight at once")
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    import httpx
+    from sqlalchemy import func, select
+
+    from app import models
+    from app.database import SessionLocal, engine
+    from app.main import app
+
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with SessionLocal() as db:
+        client = models.Client(name="Stress", email=f"stress-{time.time_ns()}@example.com", cpf=str(time.time_ns()))
+        product = models.Product(
+            description="Hot SKU", sale_value=10.0, barcode=f"STRESS-{time.time_ns()}",
+            initial_stock=args.stock, available=args.stock > 0,
+        )
+        db.add_all([client, product])
+        await db.commit()
+        client_id, product_id = client.id, product.id
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    payload = {"client_id": client_id, "status": "stress", "items": [{"product_id": product_id, "quantity": args.quantity}]}
+    latencies, statuses = [], []
+
+    async def place_order(http):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await http.post("/orders/", json=payload)
+            latencies.append(time.perf_counter() - started)
+            statuses.append(response.status_code)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress") as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(place_order(http) for _ in range(args.orders)))
+        elapsed = time.perf_counter() - started
+
+    async with SessionLocal() as db:
+        stock, available = (await db.execute(
+            select(models.Product.initial_stock, models.Product.available).where(models.Product.id == product_id)
+        )).one()
+        reserved = (await db.execute(
+            select(func.coalesce(func.sum(models.OrderItem.quantity), 0)).where(models.OrderItem.product_id == product_id)
+        )).scalar()
+    await engine.dispose()
+
+    accepted = statuses.count(200)
+    rejected = statuses.count(409)
+    expected = min(args.orders, args.stock // args.quantity)
+    latencies.sort()
+    print(f"{args.orders} orders in {elapsed:.2f}s ({args.orders / elapsed:.0f}/s), concurrency {args.concurrency}")
+    print(f"accepted {accepted}, rejected (409) {rejected}, other {len(statuses) - accepted - rejected}")
+    print(
+        f"latency p50 {statistics.median(latencies) * 1000:.1f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms"
+    )
+    print(f"stock left {stock}, reserved by items {reserved}, available {available}")
+
+    failures = []
+    if accepted != expected:
+        failures.append(f"accepted {accepted} orders, expected {expected}")
+    if accepted + rejected != args.orders:
+        failures.append("some requests failed with an unexpected status")
+    if stock != args.stock - accepted * args.quantity or stock < 0:
+        failures.append(f"stock {stock} != {args.stock} - {accepted} * {args.quantity}")
+    if reserved != accepted * args.quantity:
+        failures.append(f"order items hold {reserved} units, {accepted * args.quantity} were reserved")
+    if bool(available) != (stock > 0):
+        failures.append(f"available={available} with stock {stock}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    os.environ["DATABASE_URL"] = args.database_url  # read when app.database is imported
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())